@@ -19,6 +19,10 @@ d = tomopy.Dataset()
 # whole data array into memory.
 d.read('demo/data.h5')
 
+# Start worker processes once and reuse them
+# in all of the following operations.
+d.start_pool()
+
 # Normalize data.
 d.normalize()
 
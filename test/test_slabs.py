@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from tomopy.dataio import slabs
+
+
+_read_worker = slabs._read_worker
+
+
+def _kill_first(*args):
+    # The reader of the first slab dies as if killed by
+    # the system, the others read their slabs.
+    if args[4][0][0] == 0:
+        os._exit(9)
+    _read_worker(*args)
+
+
+class ReadSlabsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir_path, 'data.h5')
+        self.data = np.arange(8 * 6 * 5, dtype='uint16').reshape(8, 6, 5)
+        with h5py.File(self.file_name, 'w') as f:
+            f['data'] = self.data
+        self.selection = tuple(slice(0, n, 1) for n in self.data.shape)
+
+    def tearDown(self):
+        slabs._read_worker = _read_worker
+        shutil.rmtree(self.dir_path)
+
+    def test_read(self):
+        for backend in ('threads', 'processes'):
+            out, mean = slabs.read_slabs(self.file_name, 'data', self.selection,
+                                         2, backend, 'float32', return_mean=True)
+            np.testing.assert_array_equal(out, self.data)
+            self.assertAlmostEqual(mean, self.data.mean())
+
+    def test_killed_reader(self):
+        slabs._read_worker = _kill_first
+        for return_mean in (False, True):
+            self.assertRaises(RuntimeError, slabs.read_slabs, self.file_name,
+                              'data', self.selection, 2, 'processes',
+                              return_mean=return_mean)
+
+
+if __name__ == '__main__':
+    unittest.main()
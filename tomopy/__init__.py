@@ -10,6 +10,9 @@ from dataio.reader import Dataset
 
 # Hooks to other functions.
 import dataio.writer
+import dataio.raw
+import dataio.tiff
+import dataio.follow
 import preprocess.preprocess
 import recon.recon
 import postprocess.postprocess
@@ -83,6 +83,8 @@ typedef struct {
   int RadonInterpolation;
   int RadonInterpolationNone;
   int RadonInterpolationLinear;
+
+  int sinogramOrder;        /**< 1 if the input is stored as [slices, projections, pixels] instead of [projections, slices, pixels] */
 } tomoParams_t;
 
 #ifdef __cplusplus
@@ -70,6 +70,8 @@ int tomoRecon::reconstruct(int numSlices, float *center, float *pInput, float *p
    float *pIn, *pOut;
    toDoMessage_t toDoMessage;
    int reconSize = numPixels_ * numPixels_;
+   // Distance between consecutive input slices
+   int sliceStride = pTomoParams_->sinogramOrder ? numPixels_ * numProjections_ : numPixels_;
    int nextSlice=0;
    int i;
    int status;
@@ -105,14 +107,14 @@ int tomoRecon::reconstruct(int numSlices, float *center, float *pInput, float *p
      toDoMessage.pIn1 = pIn;
      toDoMessage.pOut1 = pOut;
      toDoMessage.center = center[i*2] + (paddedWidth_ - numPixels_)/2.;
-     pIn += numPixels_;
+     pIn += sliceStride;
      pOut += reconSize;
      nextSlice++;
      if (nextSlice < numSlices_)
      {
        toDoMessage.pIn2 = pIn;
        toDoMessage.pOut2 = pOut;
-       pIn += numPixels_;
+       pIn += sliceStride;
        pOut += reconSize;
        nextSlice++;
      } else
@@ -354,6 +356,8 @@ void tomoRecon::sinogram(float *pIn, float *pOut)
    float airLeft, airRight, airSlope, ratio, outData;
    float *pInData;
    float *pOutData;
+   // Distance between consecutive projections of the input slice
+   int projectionStride = pTomoParams_->sinogramOrder ? numPixels_ : numPixels_ * numSlices_;
    static const char *functionName = "tomoRecon::sinogram";
 
    if (numAir > 0) air = (float *) malloc(paddedWidth_*sizeof(float));
@@ -365,7 +369,7 @@ void tomoRecon::sinogram(float *pIn, float *pOut)
   
    for (i=0, pInData=pIn, pOutData=pOut;
         i<numProjections_;
-        i++, pInData+=numPixels_*numSlices_, pOutData+=paddedWidth_)
+        i++, pInData+=projectionStride, pOutData+=paddedWidth_)
    {
       if (numAir > 0)
       {
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import h5py
+import numpy as np
+import os
+import time
+from reader import Dataset
+from raw import _prepare
+from tomopy.preprocess.pipeline import Pipeline, stages, run_pipeline
+import logging
+logger = logging.getLogger("tomopy")
+
+
+def follow(TomoObj, file_name, operations=('normalize',),
+           num_projections=None,
+           poll_interval=1.,
+           timeout=60.,
+           dtype='float32',
+           num_cores=None,
+           backend=None,
+           log='INFO'):
+    """
+    Read and preprocess projections while they are acquired.
+
+    The file is opened in SWMR (single writer, multiple reader)
+    mode and ``/exchange/data`` is polled for projections appended
+    by the acquisition. Each new block of projections is read and
+    run through ``operations`` right away, so preprocessing is
+    mostly done when the acquisition ends and the reconstruction
+    can start immediately.
+
+    Only operations on projections (``normalize``,
+    ``phase_retrieval``) can be applied before all projections
+    are in. White and dark fields are read when following starts,
+    so they must be written before the projections.
+
+    Parameters
+    ----------
+    file_name : str
+        Data Exchange HDF5 file written in SWMR mode.
+
+    operations : list, optional
+        Operations of a ``Pipeline`` applied to each block.
+
+    num_projections : scalar, optional
+        Number of projections of the scan. Following stops when
+        they are all read, or when no projection arrived for
+        ``timeout`` seconds.
+
+    poll_interval : scalar, optional
+        Seconds between checks for new projections.
+
+    timeout : scalar, optional
+        Seconds without new projections after which the
+        acquisition is considered finished.
+
+    dtype : str, optional
+        Type the projections are read as. If None, the
+        type stored in the file is kept.
+
+    num_cores : scalar, optional
+        Number of cores processing each block.
+
+    backend : str, optional
+        Backend of the operations (see ``run_pipeline``).
+    """
+    pipeline = operations
+    if not isinstance(pipeline, Pipeline):
+        pipeline = Pipeline(operations)
+    for name, kwargs in pipeline.operations:
+        if stages[name][0] != 0:
+            raise ValueError("follow mode needs operations on projections: %s" % name)
+
+    file_name = os.path.abspath(file_name)
+    if not os.access(file_name, os.R_OK):
+        logger.error("file check: %s [failed]", file_name)
+        TomoObj.FLAG_DATA = False
+        return
+
+    _prepare(TomoObj, file_name, log)
+    TomoObj.FLAG_WHITE = False
+    TomoObj.FLAG_DARK = False
+    f = h5py.File(file_name, 'r', libver='latest', swmr=True)
+    try:
+        if 'exchange' not in f or 'data' not in f['exchange']:
+            logger.error("/exchange/data [failed]")
+            TomoObj.FLAG_DATA = False
+            return
+        exchange = f['exchange']
+        hdfdata = exchange['data']
+        _read_fields(TomoObj, exchange, hdfdata.shape[1:])
+
+        data = None
+        blocks = []
+        done = 0
+        last = time.time()
+        while num_projections is None or done < num_projections:
+            hdfdata.refresh()
+            available = hdfdata.shape[0]
+            if num_projections is not None:
+                available = min(available, num_projections)
+            if available > done:
+                block = hdfdata[done:available]
+                if dtype is not None:
+                    block = block.astype(dtype, copy=False)
+                block = _process(TomoObj, block, pipeline, num_cores, backend)
+                if num_projections is None:
+                    blocks.append(block)
+                else:
+                    # Known scans fill one preallocated volume.
+                    if data is None:
+                        data = np.empty((num_projections,) + block.shape[1:],
+                                        dtype=block.dtype)
+                    data[done:available] = block
+                logger.info("follow: projections %d-%d [ok]", done, available)
+                done = available
+                last = time.time()
+            elif time.time() - last > timeout:
+                logger.warning("follow: no new projections for %.0f s [ok]", timeout)
+                break
+            else:
+                time.sleep(poll_interval)
+
+        theta = None
+        if 'theta' in exchange:
+            exchange['theta'].refresh()
+            if exchange['theta'].shape[0] >= done:
+                theta = exchange['theta'][:done].astype(np.float32)
+    finally:
+        f.close()
+
+    if data is not None:
+        TomoObj.data = data[:done]
+    elif blocks:
+        TomoObj.data = np.concatenate(blocks)
+    else:
+        logger.error("follow: no projections [failed]")
+        TomoObj.FLAG_DATA = False
+        return
+
+    if theta is None:
+        theta = np.linspace(0, done, done) * 180 / (done + 1)
+        theta = theta.astype(np.float32)
+        logger.warning("assign 180-degree rotation [ok]")
+    TomoObj.theta = theta
+    TomoObj.FLAG_THETA = True
+    TomoObj.provenance['follow'] = {'operations':pipeline.operations,
+                                    'num_projections':done}
+    logger.info("follow %s: %d projections [ok]", file_name, done)
+
+
+def _read_fields(TomoObj, exchange, shape):
+    # White and dark fields, reduced once for all blocks.
+    if 'data_white' in exchange:
+        TomoObj.data_white = exchange['data_white'][:].astype(np.float32)
+        if TomoObj.data_white.shape[1:] == shape:
+            TomoObj.avg_white = np.mean(TomoObj.data_white, axis=0)
+            TomoObj.FLAG_WHITE = True
+            logger.info("read data_white [ok]")
+        else:
+            logger.warning("data_white compatibility [failed]")
+    else:
+        logger.warning("data_white missing [failed]")
+
+    if 'data_dark' in exchange:
+        TomoObj.data_dark = exchange['data_dark'][:].astype(np.float32)
+        if TomoObj.data_dark.shape[1:] == shape:
+            TomoObj.avg_dark = np.mean(TomoObj.data_dark, axis=0)
+            TomoObj.FLAG_DARK = True
+            logger.info("read data_dark [ok]")
+        else:
+            logger.warning("data_dark compatibility [failed]")
+    else:
+        logger.warning("data_dark missing [failed]")
+
+
+def _process(TomoObj, block, pipeline, num_cores, backend):
+    # Run the operations on one block of projections.
+    TomoObj.data = block
+    run_pipeline(TomoObj, pipeline, num_cores, None, False, backend)
+    return TomoObj.data
+
+
+setattr(Dataset, 'follow', follow)
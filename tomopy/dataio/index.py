@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata index of Data Exchange files.
+
+The shapes, types and storage layout of the exchange nodes are
+read in a single open and cached, in memory and in a JSON sidecar
+file next to the data, so batch jobs over many files on network
+storage do not reopen each file to query the same nodes. Cached
+entries are valid as long as the path, modification time and
+size of the file are unchanged.
+"""
+import h5py
+import json
+import os
+import logging
+logger = logging.getLogger("tomopy")
+
+
+# Nodes of the exchange group in the index.
+NODES = ('data', 'data_white', 'data_dark', 'theta')
+
+# In-memory index keyed by absolute path.
+_cache = {}
+
+# Format of the index, sidecars of other versions are ignored.
+_VERSION = 2
+
+
+def file_index(file_name, sidecar=True):
+    """
+    Metadata of the exchange nodes of a Data Exchange file.
+
+    Parameters
+    ----------
+    file_name : str
+        HDF5 file.
+
+    sidecar : bool, optional
+        Use, and update, the index cached next to the file in
+        ``sidecar_name(file_name)``. Sidecars are skipped if the
+        directory is not writable.
+
+    Returns
+    -------
+    out : dict
+        ``file_name``, ``mtime`` and ``size`` of the file,
+        ``exchange``, True if it has an exchange group, and
+        ``nodes``, for each of ``NODES`` present in the group
+        a dict with its ``shape``, ``dtype``, ``chunks``,
+        ``compression`` and ``filters``.
+    """
+    file_name = os.path.abspath(file_name)
+    st = os.stat(file_name)
+    key = (st.st_mtime, st.st_size)
+
+    index = _cache.get(file_name)
+    if index is not None and (index['mtime'], index['size']) == key:
+        return index
+
+    if sidecar:
+        index = _load_sidecar(file_name, key)
+        if index is not None:
+            _cache[file_name] = index
+            logger.debug("file index from %s [ok]", sidecar_name(file_name))
+            return index
+
+    f = h5py.File(file_name, 'r')
+    nodes = {}
+    exchange = 'exchange' in f
+    if exchange:
+        for name in NODES:
+            node = f['exchange'].get(name)
+            if isinstance(node, h5py.Dataset):
+                nodes[name] = node_info(node)
+    f.close()
+    index = {'version':_VERSION,
+             'file_name':file_name,
+             'mtime':key[0],
+             'size':key[1],
+             'exchange':exchange,
+             'nodes':nodes}
+    _cache[file_name] = index
+    logger.debug("file index of %s [ok]", file_name)
+
+    if sidecar:
+        _save_sidecar(index)
+    return index
+
+
+def node_info(hdfdata):
+    """
+    Shape, type and storage layout of an HDF5 dataset.
+
+    ``filters`` lists the codes of the filters of chunked
+    datasets in the order they were applied when writing.
+    """
+    filters = []
+    if hdfdata.chunks is not None:
+        plist = hdfdata.id.get_create_plist()
+        filters = [plist.get_filter(m)[0] for m in range(plist.get_nfilters())]
+    return {'shape':tuple(hdfdata.shape),
+            'dtype':hdfdata.dtype.str,
+            'chunks':hdfdata.chunks,
+            'compression':hdfdata.compression,
+            'filters':filters}
+
+
+def sidecar_name(file_name):
+    """
+    Name of the index file cached next to ``file_name``.
+    """
+    dir_path, base_name = os.path.split(os.path.abspath(file_name))
+    return os.path.join(dir_path, '.' + base_name + '.index.json')
+
+
+def clear_cache():
+    """
+    Drop the in-memory index. Sidecar files are kept.
+    """
+    _cache.clear()
+
+
+def _load_sidecar(file_name, key):
+    try:
+        with open(sidecar_name(file_name)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get('version') != _VERSION or \
+       index.get('file_name') != file_name or \
+       (index.get('mtime'), index.get('size')) != key:
+        return None
+    # JSON turns tuples into lists.
+    for node in index['nodes'].values():
+        node['shape'] = tuple(node['shape'])
+        if node['chunks'] is not None:
+            node['chunks'] = tuple(node['chunks'])
+    return index
+
+
+def _save_sidecar(index):
+    name = sidecar_name(index['file_name'])
+    if not os.access(os.path.dirname(name), os.W_OK):
+        return
+    # Write and rename, so concurrent jobs see whole files.
+    tmp_name = "%s.%d" % (name, os.getpid())
+    try:
+        with open(tmp_name, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp_name, name)
+    except (IOError, OSError):
+        logger.debug("file index sidecar %s [failed]", name)
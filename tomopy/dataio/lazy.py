@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import h5py
+import numpy as np
+from collections import OrderedDict
+
+
+# Default bound of the slab cache in bytes.
+_CACHE_BYTES = 256 * 2**20
+
+
+class LazyVolume(object):
+    """
+    Read-on-demand view of a strided selection of an HDF5 dataset.
+
+    Indexing reads only the requested region from the file, as
+    ``dtype``, and keeps recently read regions in a cache bounded
+    by ``cache_size`` bytes, dropping the least recently used
+    first. ``materialize`` reads the whole selection.
+
+    Parameters
+    ----------
+    file_name : str
+        HDF5 file, kept open until ``close``.
+
+    path : str
+        Dataset within the file.
+
+    selection : tuple of slice, optional
+        Region of the dataset seen by the view. Steps
+        must be positive.
+
+    cache_size : scalar, optional
+        Bound of the cache in bytes.
+
+    dtype : dtype, optional
+        Type of the regions read. If None, the
+        type stored in the file is kept.
+    """
+    lazy = True
+
+    def __init__(self, file_name, path, selection=None, cache_size=None,
+                 dtype=np.float32):
+        self.file_name = file_name
+        self.path = path
+        self._file = h5py.File(file_name, 'r')
+        self._dataset = self._file[path]
+        if selection is None:
+            selection = (slice(None),) * len(self._dataset.shape)
+        self._ranges = tuple(_subrange((0, n, 1), slc)
+                             for slc, n in zip(selection, self._dataset.shape))
+        if cache_size is None:
+            cache_size = _CACHE_BYTES
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        if dtype is None:
+            dtype = self._dataset.dtype
+        self._dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return tuple(_length(r) for r in self._ranges)
+
+    @property
+    def ndim(self):
+        return len(self._ranges)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        selection, squeeze = self._select(key)
+        if selection in self._cache:
+            self._cache[selection] = arr = self._cache.pop(selection)
+            return arr[squeeze].copy()
+
+        arr = self._read(selection)
+        if arr.nbytes <= self.cache_size:
+            self._cache[selection] = arr
+            self._cache_bytes += arr.nbytes
+            while self._cache_bytes > self.cache_size:
+                self._cache_bytes -= self._cache.popitem(last=False)[1].nbytes
+            arr = arr.copy()
+        return arr[squeeze]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.materialize()
+        if dtype is not None:
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def materialize(self):
+        """
+        Read the whole view into memory.
+
+        Returns
+        -------
+        out : ndarray
+            Array of shape ``shape``.
+        """
+        return self._read(self._ranges)
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def close(self):
+        """
+        Close the file handle and drop the cache.
+        """
+        self.clear_cache()
+        self._file.close()
+
+    def _select(self, key):
+        # File selection as (start, stop, step) per axis,
+        # and the index squeezing axes selected by integers.
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            m = key.index(Ellipsis)
+            key = key[:m] + (slice(None),) * (self.ndim - len(key) + 1) + key[m+1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) != self.ndim:
+            raise IndexError("too many indices")
+
+        selection = []
+        squeeze = []
+        for k, r in zip(key, self._ranges):
+            if isinstance(k, slice):
+                selection.append(_subrange(r, k))
+                squeeze.append(slice(None))
+            elif isinstance(k, (int, np.integer)):
+                n = _length(r)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError("index out of range")
+                start = r[0] + k * r[2]
+                selection.append((start, start + 1, 1))
+                squeeze.append(0)
+            else:
+                raise TypeError("only integers and slices are supported")
+        return tuple(selection), tuple(squeeze)
+
+    def _read(self, selection):
+        shape = tuple(_length(sel) for sel in selection)
+        if 0 in shape:
+            return np.empty(shape, dtype=self._dtype)
+        arr = self._dataset[tuple(slice(*sel) for sel in selection)]
+        return arr.astype(self._dtype, copy=False)
+
+
+def _length(r):
+    # Number of indices in (start, stop, step).
+    start, stop, step = r
+    return max(0, (stop - start + step - 1) // step)
+
+
+def _subrange(r, slc):
+    # Part of (start, stop, step) selected by a slice.
+    start, stop, step = slc.indices(_length(r))
+    if step < 0:
+        raise IndexError("negative steps are not supported")
+    n = _length((start, stop, step))
+    start = r[0] + start * r[2]
+    step = r[2] * step
+    return start, start + n * step, step
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import os
+from reader import Dataset
+from tomopy.tools.multiprocess import map_file
+import logging
+logger = logging.getLogger("tomopy")
+
+
+def read_raw(TomoObj, file_name, shape, dtype='uint16', offset=0,
+             data_white=None, data_dark=None, theta=None, log='INFO'):
+    """
+    Map raw binary projection data.
+
+    The data is not read but memory-mapped: pages are read from
+    the file only as operations touch them, and worker processes
+    map the same file instead of receiving pickled chunks (see
+    ``tools.multiprocess.map_file``). The file is never written,
+    operations put their results in new arrays.
+
+    Parameters
+    ----------
+    file_name : str
+        Input file holding the projections in C order.
+
+    shape : tuple
+        Dimensions of the data [projections, slices, pixels].
+
+    dtype : str, optional
+        Data type in the file.
+
+    offset : scalar, optional
+        Size of the file header in bytes.
+
+    data_white, data_dark : ndarray or str, optional
+        3-D white and dark field data [shots, slices, pixels],
+        or names of ``.npy`` files holding them.
+
+    theta : ndarray, optional
+        Projection angles in degrees. Unless given, a uniformly
+        sampled 180 degree rotation is assumed.
+    """
+    file_name = os.path.abspath(file_name)
+    size = offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if not os.path.isfile(file_name) or os.path.getsize(file_name) < size:
+        logger.error("file check: %s [failed]", file_name)
+        TomoObj.FLAG_DATA = False
+        return
+
+    _prepare(TomoObj, file_name, log)
+    TomoObj.data = map_file(file_name, shape, dtype, offset)
+    logger.info("map data from file [ok]")
+    _set_fields(TomoObj, data_white, data_dark, theta)
+
+
+def read_npy(TomoObj, file_name, data_white=None, data_dark=None, theta=None,
+             log='INFO'):
+    """
+    Map projection data saved with ``numpy.save``.
+
+    The data is memory-mapped as in ``read_raw``, with shape,
+    type and header size taken from the file.
+
+    Parameters
+    ----------
+    file_name : str
+        Input ``.npy`` file.
+
+    data_white, data_dark : ndarray or str, optional
+        3-D white and dark field data [shots, slices, pixels],
+        or names of ``.npy`` files holding them.
+
+    theta : ndarray, optional
+        Projection angles in degrees. Unless given, a uniformly
+        sampled 180 degree rotation is assumed.
+    """
+    file_name = os.path.abspath(file_name)
+    if not os.path.isfile(file_name):
+        logger.error("file check: %s [failed]", file_name)
+        TomoObj.FLAG_DATA = False
+        return
+
+    f = open(file_name, 'rb')
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+    f.close()
+    if len(shape) != 3:
+        logger.error("data dimensions [failed]")
+        TomoObj.FLAG_DATA = False
+        return
+
+    _prepare(TomoObj, file_name, log)
+    if fortran_order:
+        # Workers can not map Fortran ordered files.
+        TomoObj.data = np.load(file_name, mmap_mode='c')
+        logger.warning("map data from file (Fortran order, not shared) [ok]")
+    else:
+        TomoObj.data = map_file(file_name, shape, dtype, offset)
+        logger.info("map data from file [ok]")
+    _set_fields(TomoObj, data_white, data_dark, theta)
+
+
+def _prepare(TomoObj, file_name, log):
+    # Reset the state left by previous reads.
+    TomoObj.file_name = file_name
+    TomoObj._log_level = str(log).upper()
+    TomoObj._set_log_file()
+    TomoObj.provenance['file_name'] = file_name
+    TomoObj.index = None
+    TomoObj.avg_white = None
+    TomoObj.avg_dark = None
+    TomoObj.FLAG_DATA = True
+    TomoObj.FLAG_FILE_CHECK = True
+
+
+def _set_fields(TomoObj, data_white, data_dark, theta):
+    num_projections, num_slices, num_pixels = TomoObj.data.shape
+
+    TomoObj.FLAG_WHITE = False
+    if data_white is not None:
+        TomoObj.data_white = _load(data_white)
+        if TomoObj.data_white.shape[1:] == (num_slices, num_pixels):
+            TomoObj.FLAG_WHITE = True
+            logger.info("read data_white [ok]")
+        else:
+            logger.warning("data_white compatibility [failed]")
+
+    TomoObj.FLAG_DARK = False
+    if data_dark is not None:
+        TomoObj.data_dark = _load(data_dark)
+        if TomoObj.data_dark.shape[1:] == (num_slices, num_pixels):
+            TomoObj.FLAG_DARK = True
+            logger.info("read data_dark [ok]")
+        else:
+            logger.warning("data_dark compatibility [failed]")
+
+    if theta is not None:
+        TomoObj.theta = np.asarray(theta, dtype=np.float32)
+    else:
+        TomoObj.theta = np.linspace(0, num_projections, num_projections) \
+                        * 180 / (num_projections + 1)
+        TomoObj.theta = TomoObj.theta.astype(np.float32)
+        logger.warning("assign 180-degree rotation [ok]")
+    TomoObj.FLAG_THETA = True
+
+
+def _load(field):
+    # White and dark fields are small, read them as float32.
+    if isinstance(field, (str, type(u''))):
+        field = np.load(field)
+    return np.asarray(field, dtype=np.float32)
+
+
+setattr(Dataset, 'read_raw', read_raw)
+setattr(Dataset, 'read_npy', read_npy)
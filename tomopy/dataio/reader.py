@@ -2,7 +2,15 @@
 import h5py
 import os
 import numpy as np
+import multiprocessing as mp
 import time
+from tomopy.tools.multiprocess import WorkerPool
+from tomopy.tools.layout import layout_of, to_layout
+from tomopy.tools.instrument import Report
+from tomopy.tools.outofcore import is_resident, scratch_dataset, copy_slabs, stats
+from lazy import LazyVolume
+from slabs import read_plan, describe_plan, read_slabs, read_field, bin_selection
+from index import file_index
 import logging
 logger = logging.getLogger("tomopy")
 
@@ -56,6 +64,25 @@ class Dataset():
         TomoObj.theta = np.array(np.squeeze(theta))
         TomoObj._log_level = str(log).upper()
         
+        # Worker processes are started on demand.
+        TomoObj.pool = None
+        
+        # Let operations change the memory order of data.
+        TomoObj.auto_layout = True
+        
+        # Directory of scratch files for out-of-core data.
+        TomoObj.scratch_dir = None
+        
+        # Record timing reports of operations.
+        TomoObj.instrument = False
+        
+        # Metadata of the input file (see dataio.index).
+        TomoObj.index = None
+        
+        # White and dark fields reduced over shots while reading.
+        TomoObj.avg_white = None
+        TomoObj.avg_dark = None
+        
         # Ignore inconsistent data.
         if TomoObj.data != None:
             TomoObj.FLAG_DATA = True
@@ -82,6 +109,136 @@ class Dataset():
         TomoObj.provenance['time'] = time.strftime('%H:%M:%S')
     
     
+    def start_pool(TomoObj, num_cores=None, affinity=False):
+        """
+        Start a persistent pool of worker processes.
+        
+        Once started, all operations of the object run
+        in this pool instead of spawning new processes
+        for every call.
+        
+        Parameters
+        ----------
+        num_cores : scalar, optional
+            Number of worker processes. Defaults to the
+            number of available cores.
+            
+        affinity : bool, optional
+            Pin workers to CPUs and keep chunks on their
+            NUMA node (Linux only, see ``WorkerPool``).
+        """
+        if TomoObj.pool is not None:
+            TomoObj.close_pool()
+        TomoObj.pool = WorkerPool(num_cores, affinity)
+        logger.debug("start worker pool [ok]")
+    
+    def start_cluster(TomoObj, addresses=None, num_nodes=None,
+                      num_cores=None, authkey=None):
+        """
+        Connect to nodes and run all operations of the
+        object across them.
+        
+        The volume is split into slabs across nodes, and each
+        slab into chunks across the cores of its node. See
+        ``tomopy.tools.distributed``.
+        
+        Parameters
+        ----------
+        addresses : list, optional
+            ``(host, port)`` of nodes running ``serve_node``.
+            If not given, ``num_nodes`` local processes stand
+            in for the nodes.
+            
+        num_nodes : scalar, optional
+            Number of local nodes.
+            
+        num_cores : scalar, optional
+            Number of worker processes of each local node.
+            
+        authkey : bytes, optional
+            Key authenticating the connections to the nodes.
+        """
+        from tomopy.tools.distributed import Cluster, LocalCluster
+        if TomoObj.pool is not None:
+            TomoObj.close_pool()
+        if addresses is None:
+            if num_nodes is None:
+                num_nodes = 2
+            TomoObj.pool = LocalCluster(num_nodes, num_cores)
+        else:
+            TomoObj.pool = Cluster(addresses, authkey)
+        logger.debug("start cluster [ok]")
+    
+    def close_pool(TomoObj):
+        """
+        Shut down the persistent worker pool or
+        disconnect from the cluster.
+        """
+        if TomoObj.pool is not None:
+            TomoObj.pool.shutdown()
+            TomoObj.pool = None
+            logger.debug("close worker pool [ok]")
+    
+    def _start_report(TomoObj):
+        # A report for the next operation if instrumentation is on.
+        if TomoObj.instrument:
+            return Report()
+    
+    def _finish_report(TomoObj, name, report):
+        # Keep the summary of an operation's report in provenance.
+        if report is not None:
+            TomoObj.provenance.setdefault('reports', {})[name] = report.summary()
+            logger.debug("%s report:\n%s", name, report)
+        return report
+    
+    def materialize(TomoObj):
+        """
+        Read lazily opened ``data``, ``data_white`` and
+        ``data_dark`` into memory.
+        """
+        for name in ('data', 'data_white', 'data_dark'):
+            value = getattr(TomoObj, name)
+            if getattr(value, 'lazy', False):
+                setattr(TomoObj, name, value.materialize())
+                value.close()
+                logger.debug("materialize %s [ok]", name)
+    
+    def set_layout(TomoObj, layout, num_cores=None):
+        """
+        Change the memory order of ``data``.
+        
+        ``data`` is always indexed as [projections, slices, pixels].
+        In the ``'sinogram'`` order it is stored as contiguous
+        sinograms, which suits slice-axis operations and gridrec,
+        in the ``'projection'`` order (as read) as contiguous
+        projections. See ``tomopy.tools.layout.to_layout``.
+        
+        Parameters
+        ----------
+        layout : str
+            ``'projection'`` or ``'sinogram'``.
+            
+        num_cores : scalar, optional
+            Number of threads used for transposition.
+        """
+        if not TomoObj.FLAG_DATA:
+            return
+        if not is_resident(TomoObj.data):
+            logger.warning("data layout (out-of-core data) [bypassed]")
+            return
+        if layout_of(TomoObj.data) != layout:
+            TomoObj.data = to_layout(TomoObj.data, layout, num_cores)
+            logger.debug("data layout: %s [ok]", layout)
+    
+    def _arrange_layout(TomoObj, axis, num_cores=None):
+        # Operations chunked along slices (axis 1) run
+        # on sinograms, the others on projections.
+        if TomoObj.auto_layout and layout_of(TomoObj.data) is not None:
+            if axis == 1:
+                TomoObj.set_layout('sinogram', num_cores)
+            else:
+                TomoObj.set_layout('projection', num_cores)
+    
     def read(TomoObj, file_name,
              projections_start=None,
              projections_end=None,
@@ -96,6 +253,16 @@ class Dataset():
              white_end=None,
              dark_start=None,
              dark_end=None,
+             out_of_core=False,
+             scratch_dir=None,
+             lazy=False,
+             cache_size=None,
+             num_cores=None,
+             read_backend='threads',
+             dtype='float32',
+             flat_stats='mean',
+             keep_flats=True,
+             bin=None,
              log='INFO'):
         """
         Read Data Exchange HDF5 file.
@@ -126,7 +293,63 @@ class Dataset():
             slicing for the whole dark field shots.
 
         dtype : str, optional
-            Desired output data type.
+            Desired type of ``data``. If None, the type stored
+            in the file is kept, e.g. uint16 detector counts at
+            half the memory of float32, and ``normalize``
+            converts to float32 chunk by chunk.
+            
+        out_of_core : bool, optional
+            If True, ``data`` is not loaded into memory but
+            copied slab by slab into a scratch HDF5 dataset
+            of type ``dtype``. Operations then stream chunks from it.
+            
+        scratch_dir : str, optional
+            Directory of scratch files. Defaults to the
+            default temporary directory.
+            
+        lazy : bool, optional
+            If True, ``data``, ``data_white`` and ``data_dark``
+            are views of the file (see ``dataio.lazy.LazyVolume``)
+            reading only the regions operations ask for, e.g. a
+            single sinogram for centering. Operations that modify
+            them read them into memory first (see ``materialize``).
+            
+        cache_size : scalar, optional
+            Bound in bytes of the cache of recently read
+            regions in lazy mode.
+            
+        num_cores : scalar, optional
+            Number of workers reading ``data`` concurrently,
+            each a slab of projections. Defaults to the number
+            of available cores.
+            
+        read_backend : str, optional
+            ``'threads'``, reading into a regular array, or
+            ``'processes'``, reading into a shared array in
+            ``/dev/shm`` (see ``dataio.slabs.read_slabs``).
+            
+        flat_stats : str, optional
+            ``'mean'`` or ``'median'`` of the white and dark
+            field shots, reduced slab by slab while reading into
+            ``avg_white`` and ``avg_dark``, which ``normalize``
+            uses.
+            
+        keep_flats : bool, optional
+            If False, ``data_white`` and ``data_dark`` hold only
+            the reduced fields, and the shot stacks are never
+            held in memory as a whole.
+            
+        bin : scalar or tuple, optional
+            Numbers ``(projections, slices, pixels)`` of selected
+            indices averaged into one, e.g. ``(2, 4, 4)`` for a
+            quick preview. Unlike steps, all photons are kept.
+            Slabs of whole bins are read in parallel and averaged
+            as they arrive into a float32 volume, the only one held
+            in memory. Fields are binned alike, over slices and
+            pixels, and ``theta`` over projections. Indices left
+            over at the end of an axis are dropped. A binned
+            volume is always read into memory, ``lazy`` and
+            ``out_of_core`` are ignored.
             
         Notes
         -----
@@ -152,6 +375,7 @@ class Dataset():
         TomoObj.dark_start = dark_start
         TomoObj.dark_end = dark_end
         TomoObj._log_level = str(log).upper()
+        TomoObj.scratch_dir = scratch_dir
         
         # Prepare logging file.
         TomoObj._set_log_file()
@@ -161,12 +385,12 @@ class Dataset():
         TomoObj.provenance['file_name'] = TomoObj.file_name
 
         if TomoObj.FLAG_DATA:
-            # All looks fine. Start reading data.
-            f = h5py.File(TomoObj.file_name, "r")
-            hdfdata = f["/exchange/data"]
+            # All looks fine. Start reading data. Shapes and
+            # layouts come from the index of the file check.
+            nodes = TomoObj.index['nodes']
 
             # Prepare slicing based on data shape.
-            num_x, num_y, num_z = hdfdata.shape
+            num_x, num_y, num_z = nodes['data']['shape']
             if projections_start is None:
                 TomoObj.projections_start = 0
             if projections_end is None:
@@ -185,76 +409,132 @@ class Dataset():
                 TomoObj.pixels_end = num_z
             if pixels_step is None:
                 TomoObj.pixels_step = 1
+            selection = (slice(TomoObj.projections_start,
+                               TomoObj.projections_end,
+                               TomoObj.projections_step),
+                         slice(TomoObj.slices_start,
+                               TomoObj.slices_end,
+                               TomoObj.slices_step),
+                         slice(TomoObj.pixels_start,
+                               TomoObj.pixels_end,
+                               TomoObj.pixels_step))
+            selection = tuple(slice(*slc.indices(n))
+                              for slc, n in zip(selection, nodes['data']['shape']))
+
+            # Binned volumes use whole bins of the selection.
+            binning = None
+            if bin is not None:
+                binning = tuple(int(b) for b in np.ones(3, dtype=int) * bin)
+                selection = bin_selection(selection, binning)
+                lazy = out_of_core = False
+                dtype = 'float32'
+                TomoObj.provenance['bin'] = binning
         
-            TomoObj.data = hdfdata[TomoObj.projections_start:
-				      TomoObj.projections_end:
-					  TomoObj.projections_step,
-				  TomoObj.slices_start:
-				      TomoObj.slices_end:
-					  TomoObj.slices_step,
-				  TomoObj.pixels_start:
-				      TomoObj.pixels_end:
-					  TomoObj.pixels_step]
-            logger.info("read data from file [ok]")
+            # The mean for auto-normalization is
+            # taken while reading, where possible.
+            data_mean = None
+            need_mean = not (TomoObj.FLAG_WHITE and TomoObj.FLAG_DARK)
+        
+            if lazy:
+                # Regions are read when operations ask for them.
+                TomoObj.data = LazyVolume(TomoObj.file_name, "/exchange/data",
+                                          selection, cache_size, dtype)
+                logger.info("open data from file (lazy) [ok]")
+            elif out_of_core:
+                # Stream the selection into a scratch file.
+                shape = tuple(len(range(slc.start, slc.stop, slc.step))
+                              for slc in selection)
+                TomoObj.data = scratch_dataset(shape, dtype or nodes['data']['dtype'],
+                                               scratch_dir)
+                f = h5py.File(TomoObj.file_name, "r")
+                data_mean = copy_slabs(f["/exchange/data"], TomoObj.data, selection)
+                f.close()
+                logger.info("read data from file (out-of-core) [ok]")
+            else:
+                # Slabs follow the chunks of the file.
+                if num_cores is None:
+                    num_cores = mp.cpu_count()
+                plan = read_plan(nodes['data'], selection, num_cores)
+                TomoObj.provenance['read_plan'] = describe_plan(plan)
+                logger.info("read plan: %s", TomoObj.provenance['read_plan'])
+                TomoObj.data = read_slabs(TomoObj.file_name, "/exchange/data",
+                                          selection, num_cores, read_backend,
+                                          dtype, plan, need_mean, binning)
+                if need_mean:
+                    TomoObj.data, data_mean = TomoObj.data
+                logger.info("read data from file [ok]")
+            if need_mean and data_mean is None:
+                data_mean = _mean(TomoObj.data)
 
             # Now read white fields.
             if TomoObj.FLAG_WHITE:
-                hdfdata = f["/exchange/data_white"]
-
                 # Prepare slicing based on data shape.
                 if white_start is None:
                     TomoObj.white_start = 0
                 if white_end is None:
-                    TomoObj.white_end = hdfdata.shape[0]
+                    TomoObj.white_end = nodes['data_white']['shape'][0]
 
-                # Slice it now.
-                TomoObj.data_white = hdfdata[TomoObj.white_start:
-					         TomoObj.white_end,
-					     TomoObj.slices_start:
-						 TomoObj.slices_end:
-						     TomoObj.slices_step,
-					     TomoObj.pixels_start:
-						 TomoObj.pixels_end:
-						     TomoObj.pixels_step]
+                # Shots are reduced slab by slab as they are read.
+                rows = slice(*slice(TomoObj.white_start,
+                                    TomoObj.white_end).indices(
+                                        nodes['data_white']['shape'][0]))
+                field = (rows,) + selection[1:]
+                TomoObj.data_white, TomoObj.avg_white = read_field(
+                    TomoObj.file_name, "/exchange/data_white", field,
+                    flat_stats, keep_flats and not lazy, binning)
+                if lazy and keep_flats:
+                    TomoObj.data_white = LazyVolume(TomoObj.file_name,
+                                                    "/exchange/data_white",
+                                                    field, cache_size)
+                elif not keep_flats:
+                    TomoObj.data_white = TomoObj.avg_white[np.newaxis]
                 logger.info("read data_white from file [ok]")
             else:
                 TomoObj.data_white = np.zeros((1, TomoObj.data.shape[1], TomoObj.data.shape[2]))
-                TomoObj.data_white += np.mean(TomoObj.data[:])
+                TomoObj.data_white += data_mean
+                TomoObj.avg_white = TomoObj.data_white[0].astype(np.float32)
                 TomoObj.FLAG_WHITE = True
                 logger.warning("auto-normalization [ok]")
             
             # Now read dark fields.
             if TomoObj.FLAG_DARK:
-                hdfdata = f["/exchange/data_dark"]
-
                 # Prepare slicing based on data shape.
                 if dark_start is None:
                     TomoObj.dark_start = 0
                 if dark_end is None:
-                    TomoObj.dark_end = hdfdata.shape[0]
+                    TomoObj.dark_end = nodes['data_dark']['shape'][0]
 
-                # Slice it now.
-                TomoObj.data_dark = hdfdata[TomoObj.dark_start:
-					         TomoObj.dark_end,
-					     TomoObj.slices_start:
-						 TomoObj.slices_end:
-						     TomoObj.slices_step,
-					     TomoObj.pixels_start:
-						 TomoObj.pixels_end:
-						     TomoObj.pixels_step]
+                # Shots are reduced slab by slab as they are read.
+                rows = slice(*slice(TomoObj.dark_start,
+                                    TomoObj.dark_end).indices(
+                                        nodes['data_dark']['shape'][0]))
+                field = (rows,) + selection[1:]
+                TomoObj.data_dark, TomoObj.avg_dark = read_field(
+                    TomoObj.file_name, "/exchange/data_dark", field,
+                    flat_stats, keep_flats and not lazy, binning)
+                if lazy and keep_flats:
+                    TomoObj.data_dark = LazyVolume(TomoObj.file_name,
+                                                   "/exchange/data_dark",
+                                                   field, cache_size)
+                elif not keep_flats:
+                    TomoObj.data_dark = TomoObj.avg_dark[np.newaxis]
                 logger.info("read data_dark from file [ok]")
             else:
                 TomoObj.data_dark = np.zeros((1, TomoObj.data.shape[1], TomoObj.data.shape[2]))
-                TomoObj.data_dark += np.mean(TomoObj.data[:])
+                TomoObj.data_dark += data_mean
+                TomoObj.avg_dark = TomoObj.data_dark[0].astype(np.float32)
                 TomoObj.FLAG_DARK = True
                 logger.warning("auto-normalization [ok]")
 
             # Read projection angles.
             if TomoObj.FLAG_THETA:
+                f = h5py.File(TomoObj.file_name, "r")
                 hdfdata = f["/exchange/theta"]
-                TomoObj.theta = hdfdata[TomoObj.projections_start:
-					    TomoObj.projections_end:
-						TomoObj.projections_step]
+                TomoObj.theta = hdfdata[selection[0]]
+                f.close()
+                if binning is not None:
+                    # Angles of the averaged projections.
+                    TomoObj.theta = TomoObj.theta.reshape(-1, binning[0]).mean(axis=1)
                 logger.info("reading theta from file [ok]")
             else:
                 TomoObj.theta = np.linspace(0, TomoObj.data.shape[0], TomoObj.data.shape[0]) \
@@ -262,15 +542,11 @@ class Dataset():
                 TomoObj.FLAG_THETA = True
                 logger.warning("assign 180-degree rotation [ok]")
 
-            # All done. Close file.
-            f.close()
-            
-            # We want float32 inputs.
-            if not isinstance(TomoObj.data, np.float32):
-                TomoObj.data = TomoObj.data.astype(dtype=np.float32, copy=False)
-            if not isinstance(TomoObj.data_white, np.float32):
+            # We want float32 inputs. data is already
+            # read as dtype in every mode.
+            if is_resident(TomoObj.data_white) and not isinstance(TomoObj.data_white, np.float32):
                 TomoObj.data_white = TomoObj.data_white.astype(dtype=np.float32, copy=False)
-            if not isinstance(TomoObj.data_dark, np.float32):
+            if is_resident(TomoObj.data_dark) and not isinstance(TomoObj.data_dark, np.float32):
                 TomoObj.data_dark = TomoObj.data_dark.astype(dtype=np.float32, copy=False)
             if not isinstance(TomoObj.theta, np.float32):
                 TomoObj.theta = TomoObj.theta.astype(dtype=np.float32, copy=False)
@@ -332,7 +608,7 @@ class Dataset():
         
         Check list (flags):
             - File existence (error)
-            - File read/write permissions (error)
+            - File read permissions (error)
             - HDF5 exchange group existence (error)
             - HDF5 node existence (error)
             
@@ -357,10 +633,10 @@ class Dataset():
             TomoObj.FLAG_DATA = False
             logger.error("file check: %s [failed]", TomoObj.file_name)
 
-        # check read permissions.
+        # check read permissions. Files are never written, so
+        # read-only files, e.g. of running acquisitions, are fine.
         read_access = os.access(TomoObj.file_name, os.R_OK)
-        write_access = os.access(TomoObj.file_name, os.W_OK)
-        if read_access and write_access:
+        if read_access:
             TomoObj.FLAG_DATA = True
             logger.debug("file permissions [ok]")
         else:
@@ -379,8 +655,10 @@ class Dataset():
 
         # check exchange group.
         if TomoObj.FLAG_DATA:
-            f = h5py.File(TomoObj.file_name, 'r')
-            if "exchange" in f:
+            # Metadata of all nodes is read in one open.
+            TomoObj.index = file_index(TomoObj.file_name)
+            nodes = TomoObj.index['nodes']
+            if TomoObj.index['exchange']:
                 TomoObj.FLAG_DATA = True
                 logger.debug("/exchange group [ok]")
             else:
@@ -388,25 +666,25 @@ class Dataset():
                 logger.error("/exchange group [failed]")
             
             # Check exchange nodes.
-            if "exchange/data" in f:
+            if 'data' in nodes:
                 TomoObj.FLAG_DATA = True
                 logger.debug("/exchange/data [ok]")
             else:
                 TomoObj.FLAG_DATA = False
                 logger.error("/exchange/data [failed]")
-            if "exchange/data_white" in f:
+            if 'data_white' in nodes:
                 TomoObj.FLAG_WHITE = True
                 logger.debug("/exchange/data_white [ok]")
             else:
                 TomoObj.FLAG_WHITE = False
                 logger.warning("/exchange/data_white node [failed]")
-            if "exchange/data_dark" in f:
+            if 'data_dark' in nodes:
                 TomoObj.FLAG_DARK = True
                 logger.debug("/exchange/data_dark [ok]")
             else:
                 TomoObj.FLAG_DARK = False
                 logger.warning("/exchange/data_dark node [failed]")
-            if "exchange/theta" in f:
+            if 'theta' in nodes:
                 TomoObj.FLAG_THETA = True
                 logger.debug("/exchange/theta [ok]")
             else:
@@ -414,28 +692,28 @@ class Dataset():
                 logger.warning("/exchange/theta [failed]")
         
             # Check data dimensions.
-            if len(f["/exchange/data"].shape) == 3:
+            if len(nodes['data']['shape']) == 3:
                 TomoObj.FLAG_DATA = True
                 logger.debug("data dimensions [ok]")
             else:
                 TomoObj.FLAG_DATA = False
                 logger.error("data dimensions [failed]")
             if TomoObj.FLAG_WHITE:
-                if len(f["/exchange/data_white"].shape) == 3:
+                if len(nodes['data_white']['shape']) == 3:
                     TomoObj.FLAG_WHITE = True
                     logger.debug("data_white dimensions [ok]")
                 else:
                     TomoObj.FLAG_WHITE = False
                     logger.warning("data_white dimensions [failed]")
             if TomoObj.FLAG_DARK:
-                if len(f["/exchange/data_dark"].shape) == 3:
+                if len(nodes['data_dark']['shape']) == 3:
                     TomoObj.FLAG_DARK = True
                     logger.debug("data_dark dimensions [ok]")
                 else:
                     TomoObj.FLAG_DARK = False
                     logger.warning("data_dark dimensions [failed]")
             if TomoObj.FLAG_THETA:
-                if len(f["/exchange/theta"].shape) == 1 or len(f["/exchange/theta"].shape) == 0:
+                if len(nodes['theta']['shape']) == 1 or len(nodes['theta']['shape']) == 0:
                     TomoObj.FLAG_THETA = True
                     logger.debug("theta dimensions [ok]")
                 else:
@@ -445,21 +723,21 @@ class Dataset():
             # Check data consistencies.
             try:
                 if TomoObj.FLAG_WHITE:
-                    if f["/exchange/data_white"].shape[1:2] == f["/exchange/data"].shape[1:2]:
+                    if nodes['data_white']['shape'][1:2] == nodes['data']['shape'][1:2]:
                         TomoObj.FLAG_WHITE = True
                         logger.debug("data_white compatibility [ok]")
                     else:
                         TomoObj.FLAG_WHITE = False
                         logger.warning("data_white compatibility [failed]")
                 if TomoObj.FLAG_DARK:
-                    if f["/exchange/data_dark"].shape[1:2] == f["/exchange/data"].shape[1:2]:
+                    if nodes['data_dark']['shape'][1:2] == nodes['data']['shape'][1:2]:
                         TomoObj.FLAG_DARK = True
                         logger.debug("data_dark compatibility [ok]")
                     else:
                         TomoObj.FLAG_DARK = False
                         logger.warning("data_dark compatibility [failed]")
                 if TomoObj.FLAG_THETA:
-                    if f["/exchange/theta"].size == f["/exchange/data"].shape[0]:
+                    if int(np.prod(nodes['theta']['shape'])) == nodes['data']['shape'][0]:
                         TomoObj.FLAG_THETA = True
                         logger.debug("theta compatibility [ok]")
                     else:
@@ -473,4 +751,11 @@ class Dataset():
             logger.debug("file check [ok]")
         else:
             TomoObj.FLAG_FILE_CHECK = False
-            logger.error("file check [failed]")
\ No newline at end of file
+            logger.error("file check [failed]")
+
+
+def _mean(data):
+    # Mean of data, read slab-wise if it is not in memory.
+    if is_resident(data):
+        return np.mean(data)
+    return stats(data)[2]
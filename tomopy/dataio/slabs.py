@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+import h5py
+import numpy as np
+import multiprocessing as mp
+import itertools
+import threading
+import time
+import traceback
+import zlib
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+from tomopy.tools.multiprocess import shared_array, shm_has_room, _shared_desc, _attach_shared
+from tomopy.tools.outofcore import iter_slabs
+from index import node_info
+import logging
+logger = logging.getLogger("tomopy")
+
+
+# Upper bound of the bytes read in one call.
+_SLAB_BYTES = 64 * 2**20
+
+# Seconds to wait for the sums of readers that exited.
+_SUMS_TIMEOUT = 10.0
+
+# Filters decoded by the workers themselves (see ``_read_chunks``).
+_DECODERS = (h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE)
+
+# Direct chunk access, missing in old h5py builds.
+_DIRECT_CHUNKS = hasattr(h5py.h5d.DatasetID, 'read_direct_chunk') and \
+                 hasattr(h5py.h5d.DatasetID, 'get_chunk_info_by_coord')
+
+
+def read_plan(node, selection, num_cores=1):
+    """
+    Plan the slab reads of a strided selection of an HDF5 dataset.
+
+    Slabs along the first axis start at chunk boundaries of the
+    file, so no chunk is read, and decompressed, by two slabs.
+    Steps smaller than the chunk size along their axis (or any
+    step within rows of unchunked datasets) touch every chunk
+    anyway, and HDF5 handles such strided selections element by
+    element. Those axes are read whole and subsampled in memory.
+
+    Chunks of datasets compressed with gzip, optionally shuffled,
+    are read raw and decompressed by the workers themselves, so
+    decompression runs on all workers, threads included, instead
+    of serially inside the HDF5 library. Other filters use the
+    library path.
+
+    Parameters
+    ----------
+    node : dict
+        Metadata of the dataset (see ``dataio.index.node_info``).
+
+    selection : tuple of slice
+        Region to read, with explicit start, stop and
+        positive step on every axis.
+
+    num_cores : scalar, optional
+        Number of workers sharing the slabs.
+
+    Returns
+    -------
+    out : dict
+        ``chunks`` and ``compression`` of the dataset,
+        ``decode``, True if workers decompress the chunks,
+        ``subsample``, the axes subsampled in memory,
+        ``slab_bytes``, the bytes read by one slab at most, and
+        ``slabs``, the ``(ind_start, ind_end)`` output ranges
+        read at once.
+    """
+    chunks = node['chunks']
+    shape = tuple(_count(slc) for slc in selection)
+    subsample = [axis for axis, slc in enumerate(selection)
+                 if slc.step > 1 and shape[axis] > 1 and
+                 (slc.step < chunks[axis] if chunks is not None else axis > 0)]
+
+    # Bytes read per output index along the first axis.
+    read_shape = [_span(slc) if axis in subsample else n
+                  for axis, (slc, n) in enumerate(zip(selection, shape))]
+    index_bytes = np.dtype(node['dtype']).itemsize * int(np.prod(read_shape[1:]))
+    if 0 in subsample:
+        index_bytes *= selection[0].step
+
+    # Several slabs per worker even out the read times.
+    length = max(1, min(_SLAB_BYTES // max(index_bytes, 1),
+                        -(-shape[0] // (4 * num_cores))))
+    first = selection[0]
+    block = length * first.step
+    if chunks is not None:
+        block = max(1, int(round(float(block) / chunks[0]))) * chunks[0]
+
+    slabs = []
+    if 0 not in shape:
+        bound = first.start
+        ind_start = 0
+        while ind_start < shape[0]:
+            bound = (bound // block + 1) * block
+            ind_end = min(shape[0], -(-(bound - first.start) // first.step))
+            if ind_end > ind_start:
+                slabs.append((ind_start, ind_end))
+                ind_start = ind_end
+
+    filters = node.get('filters') or []
+    decode = _DIRECT_CHUNKS and chunks is not None and len(filters) > 0 and \
+             all(code in _DECODERS for code in filters)
+
+    return {'chunks':chunks,
+            'compression':node['compression'],
+            'decode':decode,
+            'subsample':subsample,
+            'slab_bytes':max([(e - s) * index_bytes for s, e in slabs] or [0]),
+            'slabs':slabs}
+
+
+def describe_plan(plan):
+    """
+    One line summary of a ``read_plan``.
+    """
+    return "%d slabs of up to %.1f MB, chunks %s, compression %s%s, " \
+           "subsampled axes %s" % (len(plan['slabs']), plan['slab_bytes'] / 1e6,
+                                   plan['chunks'], plan['compression'],
+                                   " (decoded by workers)" if plan.get('decode') else "",
+                                   plan['subsample'])
+
+
+def bin_selection(selection, binning):
+    """
+    Trim a selection to whole bins.
+
+    Parameters
+    ----------
+    selection : tuple of slice
+        Region to read, with explicit start, stop and
+        positive step on every axis.
+
+    binning : tuple
+        Number of selected indices averaged into one
+        along each axis.
+
+    Returns
+    -------
+    out : tuple of slice
+        The selection without the indices left over
+        at the end of each axis.
+    """
+    return tuple(slice(slc.start,
+                       slc.start + (_count(slc) // b) * b * slc.step,
+                       slc.step)
+                 for slc, b in zip(selection, binning))
+
+
+def read_slabs(file_name, path, selection, num_cores=None, backend='threads',
+               dtype=None, plan=None, return_mean=False, binning=None):
+    """
+    Read a strided selection of an HDF5 dataset in parallel.
+
+    The selection is split into slabs along its first axis
+    (see ``read_plan``), which are read concurrently by
+    ``num_cores`` workers, each with its own file handle, into
+    one preallocated array. Unless subsampled in memory, slabs
+    are read directly into the array, with HDF5 converting to
+    ``dtype`` on the way, so no intermediate copy of the data
+    in the file type is made.
+
+    Parameters
+    ----------
+    file_name : str
+        HDF5 file.
+
+    path : str
+        Dataset within the file.
+
+    selection : tuple of slice
+        Region to read, with explicit start, stop and
+        positive step on every axis.
+
+    num_cores : scalar, optional
+        Number of workers. Defaults to the number of
+        available cores.
+
+    backend : str, optional
+        ``'threads'`` reads into a regular array. HDF5 serializes
+        calls from threads of one process, so threads mainly
+        overlap the copies, and the decompression of chunks
+        decoded by the workers. ``'processes'`` reads into a
+        shared array in ``/dev/shm`` (see
+        ``tools.multiprocess.shared_array``), or with threads
+        if it has no room for the data.
+
+    dtype : dtype, optional
+        Type of the output. Defaults to the type in the file.
+
+    plan : dict, optional
+        Result of ``read_plan`` for the selection.
+
+    return_mean : bool, optional
+        Also return the mean of the data, summed by the
+        workers over each slab right after reading it.
+
+    binning : tuple, optional
+        Number of selected indices averaged into one along
+        each axis. Workers read whole bins of projections and
+        average them right away, so only the binned volume,
+        of type float32, is held in memory. The selection
+        must hold whole bins (see ``bin_selection``).
+
+    Returns
+    -------
+    out : ndarray
+        The selected data.
+
+    mean : scalar
+        Mean of ``out``, if ``return_mean``.
+    """
+    if num_cores is None:
+        num_cores = mp.cpu_count()
+    if dtype is None or plan is None:
+        f = h5py.File(file_name, 'r')
+        node = node_info(f[path])
+        f.close()
+        if dtype is None:
+            dtype = node['dtype']
+        if plan is None:
+            plan = read_plan(node, selection, num_cores)
+    dtype = np.dtype(dtype)
+    shape = tuple(_count(slc) for slc in selection)
+    slabs = plan['slabs']
+    if binning is not None:
+        dtype = np.dtype(np.float32)
+        shape = tuple(n // b for n, b in zip(shape, binning))
+        slabs = _bin_slabs(slabs, binning[0])
+    num_cores = max(1, min(num_cores, len(slabs)))
+    logger.debug("read plan of %s: %s", path, describe_plan(plan))
+
+    sums = None
+    if return_mean:
+        sums = mp.Queue()
+
+    # Volumes are not spilled to disk when shared memory is short.
+    if backend == 'processes' and \
+       not shm_has_room(int(np.prod(shape)) * dtype.itemsize):
+        logger.warning("read %s: no room in /dev/shm, reading with threads", path)
+        backend = 'threads'
+
+    tic = time.time()
+    if backend == 'processes':
+        out = shared_array(shape, dtype)
+        target = _shared_desc(out, 0)
+        errors = mp.Queue()
+        workers = [mp.Process(target=_read_worker,
+                              args=(file_name, path, selection, target,
+                                    slabs[m::num_cores], plan['subsample'],
+                                    plan.get('decode', False), binning,
+                                    errors, sums))
+                   for m in range(num_cores)]
+    elif backend == 'threads':
+        out = np.empty(shape, dtype)
+        target = out
+        errors = mp.Queue()
+        workers = [threading.Thread(target=_read_worker,
+                                    args=(file_name, path, selection, target,
+                                          slabs[m::num_cores], plan['subsample'],
+                                          plan.get('decode', False), binning,
+                                          errors, sums))
+                   for m in range(num_cores)]
+    else:
+        raise ValueError("unknown backend: %s" % backend)
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if not errors.empty():
+        raise RuntimeError("slab read failed:\n" + errors.get())
+    # Killed readers report nothing and leave their slabs empty.
+    if backend == 'processes':
+        for worker in workers:
+            if worker.exitcode != 0:
+                raise RuntimeError("slab reader process died (exit code %s)"
+                                   % worker.exitcode)
+
+    elapsed = time.time() - tic
+    logger.info("read %s: %.1f MB in %.2f s (%.1f MB/s, %d %s) [ok]", path,
+                out.nbytes / 1e6, elapsed, out.nbytes / 1e6 / max(elapsed, 1e-9),
+                num_cores, backend)
+    if return_mean:
+        try:
+            total = sum(sums.get(timeout=_SUMS_TIMEOUT) for worker in workers)
+        except Empty:
+            raise RuntimeError("slab read failed: missing sums of %s" % path)
+        return out, total / max(out.size, 1)
+    return out
+
+
+def read_field(file_name, path, selection, method='mean', keep=True,
+               binning=None):
+    """
+    Read a stack of white or dark field shots and reduce it
+    to one field over the shots.
+
+    Slabs of slices are read one at a time and reduced as they
+    arrive, so unless the stack is kept only one slab of it is
+    held in memory.
+
+    Parameters
+    ----------
+    file_name : str
+        HDF5 file.
+
+    path : str
+        Dataset within the file.
+
+    selection : tuple of slice
+        Shots, slices and pixels to read, with explicit
+        start, stop and positive step.
+
+    method : str, optional
+        ``'mean'`` or ``'median'`` over the shots.
+
+    keep : bool, optional
+        Return the stack as well.
+
+    binning : tuple, optional
+        Binning of the data (see ``read_slabs``). Slices and
+        pixels of the shots are binned alike, shots are not.
+        The selection must hold whole bins.
+
+    Returns
+    -------
+    stack : ndarray
+        float32 stack of shots, or None unless ``keep``.
+
+    field : ndarray
+        2-D float32 reduced field.
+    """
+    if method == 'mean':
+        reduce = np.mean
+    elif method == 'median':
+        reduce = np.median
+    else:
+        raise ValueError("unknown method: %s" % method)
+    if binning is None:
+        binning = (1, 1, 1)
+    binning = (1,) + tuple(binning[1:])
+    shape = tuple(_count(slc) // b for slc, b in zip(selection, binning))
+    field = np.empty(shape[1:], dtype=np.float32)
+    stack = None
+    if keep:
+        stack = np.empty(shape, dtype=np.float32)
+
+    f = h5py.File(file_name, 'r')
+    hdfdata = f[path]
+    rows = selection[1]
+    step = rows.step * binning[1]
+    for ind_start, ind_end in iter_slabs(shape, 1, 4):
+        source = (selection[0],
+                  slice(rows.start + ind_start * step,
+                        rows.start + ind_end * step, rows.step),
+                  selection[2])
+        slab = hdfdata[source].astype(np.float32, copy=False)
+        if binning != (1, 1, 1):
+            slab = _bin(slab, binning)
+        if keep:
+            stack[:, ind_start:ind_end] = slab
+        field[ind_start:ind_end] = reduce(slab, axis=0)
+    f.close()
+    return stack, field
+
+
+def _read_worker(file_name, path, selection, target, slabs, subsample,
+                 decode, binning, errors, sums):
+    try:
+        if isinstance(target, tuple):
+            target = _attach_shared(target)
+        f = h5py.File(file_name, 'r')
+        hdfdata = f[path]
+        filters = None
+        if decode:
+            filters = node_info(hdfdata)['filters']
+        total = 0.
+        for ind_start, ind_end in slabs:
+            if binning is None:
+                _read_slab(hdfdata, selection, subsample, filters,
+                           ind_start, ind_end, target[ind_start:ind_end])
+            else:
+                # Whole bins of projections are read and averaged.
+                shape = ((ind_end - ind_start) * binning[0],) + \
+                        tuple(n * b for n, b in zip(target.shape[1:], binning[1:]))
+                block = np.empty(shape, dtype=target.dtype)
+                _read_slab(hdfdata, selection, subsample, filters,
+                           ind_start * binning[0], ind_end * binning[0], block)
+                target[ind_start:ind_end] = _bin(block, binning)
+            if sums is not None:
+                total += target[ind_start:ind_end].sum(dtype=np.float64)
+        f.close()
+        if sums is not None:
+            sums.put(total)
+    except Exception:
+        errors.put(traceback.format_exc())
+
+
+def _read_slab(hdfdata, selection, subsample, filters, ind_start, ind_end, out):
+    # Read the output range [ind_start, ind_end) of a selection
+    # into out, decoding chunks if filters are given.
+    first = selection[0]
+    start = first.start + ind_start * first.step
+    stop = first.start + (ind_end - 1) * first.step + 1
+    if filters is not None:
+        source = (slice(start, stop, first.step),) + selection[1:]
+        _read_chunks(hdfdata, source, filters, out)
+    elif subsample:
+        # Axes subsampled in memory are read whole.
+        inner = tuple(slice(slc.start, slc.start + _span(slc))
+                      if axis in subsample else slc
+                      for axis, slc in enumerate(selection) if axis > 0)
+        steps = tuple(slice(None, None, slc.step) if axis in subsample
+                      else slice(None) for axis, slc in enumerate(selection))
+        if 0 in subsample:
+            source = (slice(start, stop),) + inner
+        else:
+            source = (slice(start, stop, first.step),) + inner
+        out[:] = hdfdata[source][steps]
+    else:
+        source = (slice(start, stop, first.step),) + selection[1:]
+        hdfdata.read_direct(out, source)
+
+
+def _read_chunks(hdfdata, selection, filters, out):
+    # Read the chunks holding a strided selection raw, undo
+    # their filters and copy the selected elements into out.
+    # zlib releases the GIL, so threads decompress in parallel.
+    chunks = hdfdata.chunks
+    dtype = hdfdata.dtype
+    # Per axis, the chunks holding selected indices, with the
+    # output range and the slice within the chunk of each.
+    parts = []
+    for slc, size in zip(selection, chunks):
+        index = np.arange(slc.start, slc.stop, slc.step)
+        axis_parts = []
+        for k in np.unique(index // size):
+            where = np.nonzero(index // size == k)[0]
+            local = index[where] - k * size
+            axis_parts.append((k * size,
+                               slice(where[0], where[-1] + 1),
+                               slice(local[0], local[-1] + 1, slc.step)))
+        parts.append(axis_parts)
+
+    for combo in itertools.product(*parts):
+        offset = tuple(p[0] for p in combo)
+        info = hdfdata.id.get_chunk_info_by_coord(offset)
+        if info.byte_offset is None:
+            # Never written, holds the fill value.
+            out[tuple(p[1] for p in combo)] = hdfdata.fillvalue
+            continue
+        mask, buf = hdfdata.id.read_direct_chunk(offset)
+        for m in reversed(range(len(filters))):
+            if mask & (1 << m):
+                continue
+            if filters[m] == h5py.h5z.FILTER_DEFLATE:
+                buf = zlib.decompress(buf)
+            elif filters[m] == h5py.h5z.FILTER_SHUFFLE:
+                buf = np.frombuffer(buf, dtype=np.uint8)
+                buf = buf.reshape(dtype.itemsize, -1).T.tobytes()
+        chunk = np.frombuffer(buf, dtype=dtype).reshape(chunks)
+        out[tuple(p[1] for p in combo)] = chunk[tuple(p[2] for p in combo)]
+
+
+def _bin(data, binning):
+    # Average blocks of binning[axis] indices of a volume
+    # whose shape is a multiple of the binning.
+    shape = []
+    for n, b in zip(data.shape, binning):
+        shape += [n // b, b]
+    return data.reshape(shape).mean(axis=(1, 3, 5), dtype=np.float32)
+
+
+def _bin_slabs(slabs, size):
+    # Slabs of whole bins, with bounds rounded down to bins.
+    bounds = sorted(set([0] + [ind_end // size for ind_start, ind_end in slabs]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _count(slc):
+    # Number of indices selected by an explicit slice.
+    return max(0, (slc.stop - slc.start + slc.step - 1) // slc.step)
+
+
+def _span(slc):
+    # Length of the index range covered by an explicit slice.
+    return max(0, (_count(slc) - 1) * slc.step + 1)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import glob
+import os
+import re
+import time
+from PIL import Image
+from reader import Dataset
+from raw import _prepare, _set_fields
+from tomopy.tools.multiprocess import worker, distribute_jobs
+import logging
+logger = logging.getLogger("tomopy")
+
+
+@worker
+def decode_tiff(args):
+    """
+    Decode TIFF files into consecutive projections.
+    """
+    data, args, ind_start, ind_end = args
+    files, crop = args
+    for m in range(ind_end - ind_start):
+        data[m] = np.asarray(Image.open(files[ind_start + m]))[crop]
+    return ind_start, ind_end, data
+
+
+# Pillow decodes without the GIL, threads write in place.
+decode_tiff.backend = 'threads'
+
+
+def read_tiff(TomoObj, file_pattern,
+              white_pattern=None,
+              dark_pattern=None,
+              projections_start=None,
+              projections_end=None,
+              projections_step=None,
+              slices_start=None,
+              slices_end=None,
+              slices_step=None,
+              pixels_start=None,
+              pixels_end=None,
+              pixels_step=None,
+              theta=None,
+              dtype='float32',
+              num_cores=None,
+              log='INFO'):
+    """
+    Read a stack of TIFF projections.
+
+    Files are sorted by the numbers in their names and decoded
+    concurrently by ``num_cores`` threads directly into the
+    volume. Only the files of the selected projections are
+    decoded.
+
+    Parameters
+    ----------
+    file_pattern : str
+        Directory of the projections, or a glob pattern
+        such as ``'scan/proj_*.tif'``.
+
+    white_pattern, dark_pattern : str, optional
+        Directories or patterns of the white and dark fields.
+
+    projections_start, projections_end, projections_step : scalar, optional
+        Values of the start, end and step of the projections
+        (files) to be read.
+
+    slices_start, slices_end, slices_step : scalar, optional
+        Values of the start, end and step of the slices (rows
+        of the images) to be read.
+
+    pixels_start, pixels_end, pixels_step : scalar, optional
+        Values of the start, end and step of the pixels
+        (columns of the images) to be read.
+
+    theta : ndarray, optional
+        Projection angles in degrees of the selected projections.
+        Unless given, a uniformly sampled 180 degree rotation
+        is assumed.
+
+    dtype : str, optional
+        Desired type of ``data``. If None, the type of the
+        images is kept.
+
+    num_cores : scalar, optional
+        Number of decoding threads.
+    """
+    files = _find_files(file_pattern)
+    if not files:
+        logger.error("file check: %s [failed]", file_pattern)
+        TomoObj.FLAG_DATA = False
+        return
+    files = files[projections_start:projections_end:projections_step]
+    if not files:
+        logger.error("projection range [failed]")
+        TomoObj.FLAG_DATA = False
+        return
+
+    _prepare(TomoObj, files[0], log)
+    crop = (slice(slices_start, slices_end, slices_step),
+            slice(pixels_start, pixels_end, pixels_step))
+    TomoObj.provenance['tiff_files'] = (files[0], files[-1], len(files))
+
+    report = TomoObj._start_report()
+    TomoObj.data = _decode(files, crop, dtype, num_cores, report)
+    logger.info("read data from files [ok]")
+
+    # Flat and dark fields use the same cropping.
+    data_white = data_dark = None
+    if white_pattern is not None:
+        white_files = _find_files(white_pattern)
+        if white_files:
+            data_white = _decode(white_files, crop, np.float32, num_cores, report)
+        else:
+            logger.warning("data_white files [failed]")
+    if dark_pattern is not None:
+        dark_files = _find_files(dark_pattern)
+        if dark_files:
+            data_dark = _decode(dark_files, crop, np.float32, num_cores, report)
+        else:
+            logger.warning("data_dark files [failed]")
+    _set_fields(TomoObj, data_white, data_dark, theta)
+    return TomoObj._finish_report('read_tiff', report)
+
+
+def _decode(files, crop, dtype, num_cores, report):
+    # Decode files into a preallocated volume,
+    # sized from the header of the first one.
+    num_pixels, num_slices = Image.open(files[0]).size
+    shape = (len(files),
+             len(range(*crop[0].indices(num_slices))),
+             len(range(*crop[1].indices(num_pixels))))
+    if dtype is None:
+        dtype = np.asarray(Image.open(files[0])).dtype
+    data = np.empty(shape, dtype=dtype)
+    tic = time.time()
+    distribute_jobs(data, decode_tiff, (files, crop), 0, num_cores, None,
+                    backend='threads', report=report)
+    elapsed = time.time() - tic
+    logger.info("decoded %d files: %.1f MB in %.2f s (%.1f MB/s, %.1f files/s) [ok]",
+                len(files), data.nbytes / 1e6, elapsed,
+                data.nbytes / 1e6 / max(elapsed, 1e-9),
+                len(files) / max(elapsed, 1e-9))
+    return data
+
+
+def _find_files(pattern):
+    # TIFF files of a directory, or matching a pattern,
+    # in the order of the numbers in their names.
+    if os.path.isdir(pattern):
+        files = glob.glob(os.path.join(pattern, '*.tif')) + \
+                glob.glob(os.path.join(pattern, '*.tiff'))
+    else:
+        files = glob.glob(pattern)
+    return sorted(files, key=_natural_key)
+
+
+def _natural_key(file_name):
+    return [(0, int(part)) if part.isdigit() else (1, part)
+            for part in re.split(r'(\d+)', os.path.basename(file_name))]
+
+
+setattr(Dataset, 'read_tiff', read_tiff)
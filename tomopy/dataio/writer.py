@@ -4,6 +4,7 @@ import os
 import numpy as np
 from scipy import misc
 from reader import Dataset
+from tomopy.tools.outofcore import is_resident, copy_slabs
 import logging
 logger = logging.getLogger("tomopy")
 
@@ -382,7 +383,13 @@ def _export_to_hdf5(file_name, data, provenance):
     f = h5py.File(file_name, 'w')
     f.create_dataset('implements', data='exchange')
     exchange_group = f.create_group("processed")
-    exchange_group.create_dataset('data', data=data)
+    if is_resident(data):
+        exchange_group.create_dataset('data', data=data)
+    else:
+        # Copy out-of-core data slab by slab.
+        dset = exchange_group.create_dataset('data', shape=data.shape,
+                                             dtype=data.dtype)
+        copy_slabs(data, dset)
     provenance_group = f.create_group("provenance")
     for key, value in provenance.iteritems():
         provenance_group.create_dataset(key, data=str(value))
@@ -7,6 +7,7 @@ from region_segment import region_segment
 from threshold_segment import threshold_segment
 import multiprocessing as mp
 from tomopy.tools.multiprocess import distribute_jobs
+from tomopy.tools.outofcore import is_resident, stats, rescale
 import logging
 logger = logging.getLogger("tomopy")
 
@@ -16,14 +17,14 @@ from skimage.filter import sobel
 
 
 def adaptive_segment_wrapper(TomoObj, block_size=None, offset=None,
-                              num_cores=None, chunk_size=None):
+                              num_cores=None, chunk_size=None, shared=False,
+                              backend='auto'):
     if not TomoObj.FLAG_DATA_RECON:
         logger.warning("adaptive thresholding based segmentation (recon data missing) [bypassed]")
         return
     
     # Normalize data first.
-    data = TomoObj.data_recon - TomoObj.data_recon.min()
-    data /= data.max()
+    data = _normalized_recon(TomoObj)
     
     if block_size == None:
         block_size = 256
@@ -34,38 +35,47 @@ def adaptive_segment_wrapper(TomoObj, block_size=None, offset=None,
     # Distribute jobs.
     axis = 0 # Slice axis
     args = (block_size, offset)
+    report = TomoObj._start_report()
     TomoObj.data_recon = distribute_jobs(data, adaptive_segment, args,
-                                         axis, num_cores, chunk_size)
+                                         axis, num_cores, chunk_size, shared,
+                                         pool=TomoObj.pool, backend=backend,
+                                         report=report)
                                          
     # Update provenance.
     TomoObj.provenance['adaptive_segment'] = {'block_size':block_size, 'offset':offset}
 
     logger.info("adaptive thresholding based segmentation [ok]")
+    return TomoObj._finish_report('adaptive_segment', report)
 
 
 def region_segment_wrapper(TomoObj, low, high,
-                           num_cores=None, chunk_size=None):
+                           num_cores=None, chunk_size=None, shared=False,
+                           backend='auto'):
     if not TomoObj.FLAG_DATA_RECON:
         logger.warning("region based segmentation (recon data missing) [bypassed]")
         return
     
     # Normalize data first.
-    data = TomoObj.data_recon - TomoObj.data_recon.min()
-    data /= data.max()
+    data = _normalized_recon(TomoObj)
     
     # Distribute jobs.
     axis = 0 # Slice axis
     args = (low, high)
+    report = TomoObj._start_report()
     TomoObj.data_recon = distribute_jobs(data, region_segment, args,
-                                         axis, num_cores, chunk_size)
+                                         axis, num_cores, chunk_size, shared,
+                                         pool=TomoObj.pool, backend=backend,
+                                         report=report)
 
     # Update provenance.
     TomoObj.provenance['region_segment'] = {'low':low, 'high':high}
 
     logger.info("region based segmentation [ok]")
+    return TomoObj._finish_report('region_segment', report)
 
 
-def remove_bg_wrapper(TomoObj, num_cores=None, chunk_size=None):
+def remove_bg_wrapper(TomoObj, num_cores=None, chunk_size=None, shared=False,
+                      backend='auto'):
     if not TomoObj.FLAG_DATA_RECON:
         logger.warning("adaptive thresholding based segmentation (recon data missing) [bypassed]")
         return
@@ -73,36 +83,56 @@ def remove_bg_wrapper(TomoObj, num_cores=None, chunk_size=None):
     # Distribute jobs.
     axis = 0 # Slice axis
     args = ()
+    report = TomoObj._start_report()
     TomoObj.data_recon = distribute_jobs(TomoObj.data_recon, remove_bg, args,
-                                         axis, num_cores, chunk_size)
+                                         axis, num_cores, chunk_size, shared,
+                                         pool=TomoObj.pool, backend=backend,
+                                         report=report)
                                          
     # Update provenance.
     TomoObj.provenance['adaptive_segment'] = {}
     
     logger.info("background removal [ok]")
+    return TomoObj._finish_report('remove_bg', report)
 
 
 
 def threshold_segment_wrapper(TomoObj, cutoff=None,
-                           num_cores=None, chunk_size=None):
+                           num_cores=None, chunk_size=None, shared=False,
+                           backend='auto'):
     if not TomoObj.FLAG_DATA_RECON:
         logger.warning("threshold based segmentation (recon data missing) [bypassed]")
         return
     
     # Normalize data first.
-    data = TomoObj.data_recon - TomoObj.data_recon.min()
-    data /= data.max()
+    data = _normalized_recon(TomoObj)
 
     # Distribute jobs.
     axis = 0 # Slice axis
     args = (cutoff)
+    report = TomoObj._start_report()
     TomoObj.data_recon = distribute_jobs(data, threshold_segment, args,
-                                         axis, num_cores, chunk_size)
+                                         axis, num_cores, chunk_size, shared,
+                                         pool=TomoObj.pool, backend=backend,
+                                         report=report)
                                                       
     # Update provenance.
     TomoObj.provenance['threshold_segment'] = {'cutoff':cutoff}
     
     logger.info("threshold based segmentation [ok]")
+    return TomoObj._finish_report('threshold_segment', report)
+
+
+def _normalized_recon(TomoObj):
+    # Scale data_recon to [0, 1]. Out-of-core
+    # data is rescaled in place, slab by slab.
+    if is_resident(TomoObj.data_recon):
+        data = TomoObj.data_recon - TomoObj.data_recon.min()
+        data /= data.max()
+        return data
+    data_min, data_max = stats(TomoObj.data_recon)[0:2]
+    rescale(TomoObj.data_recon, data_min, data_max - data_min)
+    return TomoObj.data_recon
 
 
 setattr(Dataset, 'adaptive_segment', adaptive_segment_wrapper)
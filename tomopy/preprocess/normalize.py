@@ -32,8 +32,17 @@ def normalize(args):
     data, args, ind_start, ind_end = args
     data_white, data_dark, cutoff = args
 
+    # Raw integer projections are converted chunk by chunk.
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float32)
     for m in range(ind_end-ind_start):
         data[m, :, :] = np.divide(data[m, :, :]-data_dark, data_white-data_dark)
     if cutoff is not None:
         data[data > cutoff] = cutoff
-    return ind_start, ind_end, data
\ No newline at end of file
+    return ind_start, ind_end, data
+
+
+# np.divide releases the GIL, threads avoid pickling chunks.
+normalize.backend = 'threads'
+# Output type of raw integer projections.
+normalize.dtype = np.float32
@@ -44,14 +44,19 @@ def phase_retrieval(args):
     <http://onlinelibrary.wiley.com/doi/10.1046/j.1365-2818.2002.01010.x/abstract>`_
     """
     data, args, ind_start, ind_end = args
-    H, x_shift, y_shift, tmp_proj, padding = args
+    H, x_shift, y_shift, padding = args
     
     num_proj, dx, dy = data.shape # dx:slices, dy:pixels
     
+    if padding:
+        tmp_proj = np.empty(H.shape, dtype='float32')
+    
     for m in range(num_proj):
         proj = data[m, :, :]
         
         if padding:
+            # Pad with the mean value of the projection edges.
+            tmp_proj[:] = np.mean((proj[:, 0] + proj[:, dy-1]) / 2)
             tmp_proj[x_shift:dx+x_shift, y_shift:dy+y_shift] = proj
             fft_proj = fftw.fftw2(tmp_proj)
             filtered_proj = np.multiply(H, fft_proj)
@@ -66,6 +71,10 @@ def phase_retrieval(args):
         data[m, :, :] = proj
         
     return ind_start, ind_end, data
+
+
+# The FFTW wrapper keeps static plans and buffers.
+phase_retrieval.thread_safe = False
     
 
 def paganin_filter(data, pixel_size, dist, energy, alpha, padding):
@@ -74,22 +83,16 @@ def paganin_filter(data, pixel_size, dist, energy, alpha, padding):
                 constants.SPEED_OF_LIGHT / energy
                 
     if padding:
-        # Find padding values.
-        pad_value = np.mean((data[:, :, 0] + data[:, :, dy-1]) / 2)
-        
         # Fourier padding in powers of 2.
         pad_pixels = np.ceil(constants.PI * wavelength * dist / pixel_size ** 2)
-        num_x = pow(2, np.ceil(np.log2(dx + pad_pixels)))
-        num_y = pow(2, np.ceil(np.log2(dy + pad_pixels)))
+        num_x = int(pow(2, np.ceil(np.log2(dx + pad_pixels))))
+        num_y = int(pow(2, np.ceil(np.log2(dy + pad_pixels))))
         x_shift = int((num_x - dx) / 2.0)
         y_shift = int((num_y - dy) / 2.0)
         
-        # Template padded image.
-        tmp_proj = pad_value * np.ones((num_x, num_y), dtype='float32')
-        
     elif not padding:
         num_x, num_y = dx, dy
-        x_shift, y_shift, tmp_data = None, None, None
+        x_shift, y_shift = None, None
                 
     # Sampling in reciprocal space.
     indx = (1 / ((num_x-1) * pixel_size)) * np.arange(-(num_x-1)*0.5, num_x*0.5)
@@ -101,5 +104,4 @@ def paganin_filter(data, pixel_size, dist, energy, alpha, padding):
     H = 1 / (wavelength * dist * w2 / (4 * constants.PI) + alpha)
     H = np.fft.fftshift(H)
 
-    return H, x_shift, y_shift, tmp_proj
-
+    return H, x_shift, y_shift
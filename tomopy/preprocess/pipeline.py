@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from tomopy.tools.multiprocess import worker, get_kernel, kernel_name, distribute_jobs
+import logging
+logger = logging.getLogger("tomopy")
+
+
+# Registered operations as (axis, prepare) by name. The prepare
+# function receives TomoObj and the keyword arguments of the
+# operation and returns (kernel, args, provenance), or None
+# if the operation has to be bypassed.
+stages = {}
+
+
+def register_stage(name, axis, prepare):
+    """
+    Make an operation available to ``Pipeline``.
+    """
+    stages[name] = (axis, prepare)
+
+
+@worker
+def fused(args):
+    """
+    Apply a sequence of kernels to the same chunk.
+    """
+    data, kernels, ind_start, ind_end = args
+    for name, kernel_args in kernels:
+        ind_start, ind_end, data = get_kernel(name)((data, kernel_args,
+                                                     ind_start, ind_end))
+    return ind_start, ind_end, data
+
+
+class Pipeline(object):
+    def __init__(self, operations):
+        """
+        Ordered chain of operations applied with as few
+        passes over the data as possible.
+
+        Consecutive operations chunked along the same axis
+        are fused into a single kernel, so each chunk goes
+        through all of them while it is still in cache. The
+        data is only re-chunked when the axis changes.
+
+        Parameters
+        ----------
+        operations : list
+            Operation names or ``(name, kwargs)`` pairs, e.g.
+            ``['normalize', ('phase_retrieval', {'pixel_size':1e-4,
+            'dist':70, 'energy':30}), 'median_filter']``.
+        """
+        self.operations = []
+        for op in operations:
+            if isinstance(op, str):
+                name, kwargs = op, {}
+            else:
+                name, kwargs = op
+            if name not in stages:
+                raise ValueError("unknown pipeline operation: %s" % name)
+            self.operations.append((name, dict(kwargs)))
+
+    def groups(self):
+        """
+        Split operations into runs sharing the chunking axis.
+
+        Returns
+        -------
+        out : list
+            List of ``(axis, operations)`` pairs.
+        """
+        groups = []
+        for name, kwargs in self.operations:
+            axis = stages[name][0]
+            if groups and groups[-1][0] == axis:
+                groups[-1][1].append((name, kwargs))
+            else:
+                groups.append((axis, [(name, kwargs)]))
+        return groups
+
+
+def run_pipeline(TomoObj, operations, num_cores=None, chunk_size=None,
+                 shared=False, backend=None, report=None):
+    """
+    Run a ``Pipeline`` of preprocessing operations on the data.
+
+    Parameters
+    ----------
+    operations : Pipeline or list
+        The pipeline or the list of its operations
+        (see ``Pipeline``).
+
+    backend : str, optional
+        Backend of ``distribute_jobs``. By default fused
+        kernels run on threads only if all their stages
+        prefer threads, and on processes otherwise.
+
+    report : Report, optional
+        Records the chunks of all passes
+        (see ``tools.instrument``).
+    """
+    pipeline = operations
+    if not isinstance(pipeline, Pipeline):
+        pipeline = Pipeline(operations)
+
+    passes = []
+    for axis, group in pipeline.groups():
+        # Prepare stages right before their pass so that they
+        # see the data as left by the previous passes.
+        kernels = []
+        for name, kwargs in group:
+            stage = stages[name][1](TomoObj, **kwargs)
+            if stage is not None:
+                kernels.append((name, stage))
+        if not kernels:
+            continue
+
+        halo = None
+        dtype = None
+        if len(kernels) == 1:
+            func, args = kernels[0][1][0:2]
+            pass_backend = 'auto'
+        else:
+            func = fused
+            args = [(kernel_name(stage[0]), stage[1]) for name, stage in kernels]
+            # Each stage spoils its halo of the previous output.
+            halo = sum(getattr(stage[0], 'halo', 0) for name, stage in kernels)
+            dtypes = [stage[0].dtype for name, stage in kernels
+                      if hasattr(stage[0], 'dtype')]
+            # As for single kernels, only integer data is converted.
+            if dtypes and np.issubdtype(TomoObj.data.dtype, np.integer):
+                dtype = dtypes[0]
+            if all(getattr(stage[0], 'backend', None) == 'threads'
+                   for name, stage in kernels):
+                pass_backend = 'threads'
+            else:
+                pass_backend = 'processes'
+        if backend is not None:
+            pass_backend = backend
+        # Never run kernels with static state on threads.
+        if pass_backend in ('threads', 'auto') and \
+           not all(getattr(stage[0], 'thread_safe', True) for name, stage in kernels):
+            pass_backend = 'processes'
+
+        TomoObj._arrange_layout(axis, num_cores)
+        TomoObj.data = distribute_jobs(TomoObj.data, func, args, axis,
+                                       num_cores, chunk_size, shared,
+                                       pool=TomoObj.pool, backend=pass_backend,
+                                       report=report, halo=halo, dtype=dtype)
+
+        # Update provenance.
+        for name, stage in kernels:
+            TomoObj.provenance[name] = stage[2]
+        passes.append([name for name, stage in kernels])
+        logger.debug("pipeline pass %s [ok]", ", ".join(passes[-1]))
+
+    TomoObj.provenance['pipeline'] = passes
+    logger.info("pipeline (%d passes) [ok]", len(passes))
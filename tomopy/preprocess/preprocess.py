@@ -4,6 +4,7 @@ from median_filter import median_filter
 from normalize import normalize
 import phase_retrieval
 from stripe_removal import stripe_removal
+from pipeline import register_stage, run_pipeline
 import numpy as np
 import multiprocessing as mp
 from tomopy.tools import multiprocess
@@ -12,99 +13,181 @@ logger = logging.getLogger("tomopy")
 
 
 def median_filter_wrapper(TomoObj, size=5,
-                          num_cores=None, chunk_size=None):
-    if not TomoObj.FLAG_DATA:
-        logger.warning("median filtering (data missing) [bypassed]")
+                          num_cores=None, chunk_size=None, shared=False,
+                          backend='auto'):
+    # Lazily read data is modified in memory.
+    TomoObj.materialize()
+    stage = _median_filter_stage(TomoObj, size)
+    if stage is None:
         return
-        
+    func, args, pars = stage
+
     # Distribute jobs.
     axis = 1 # Slice axis
-    args = (size)
-    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, median_filter, args,
-                                 axis, num_cores, chunk_size)
-   
+    report = TomoObj._start_report()
+    TomoObj._arrange_layout(axis, num_cores)
+    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, func, args,
+                                 axis, num_cores, chunk_size, shared,
+                                 pool=TomoObj.pool, backend=backend,
+                                 report=report)
+
     # Update provenance.
-    TomoObj.provenance['median_filter'] = {'size':size}
-    
+    TomoObj.provenance['median_filter'] = pars
+
     logger.info("median filtering [ok]")
+    return TomoObj._finish_report('median_filter', report)
+
+
+def _median_filter_stage(TomoObj, size=5):
+    if not TomoObj.FLAG_DATA:
+        logger.warning("median filtering (data missing) [bypassed]")
+        return
+
+    args = (size)
+    return median_filter, args, {'size':size}
 
 
 def normalize_wrapper(TomoObj, cutoff=None,
-                      num_cores=None, chunk_size=None):
+                      num_cores=None, chunk_size=None, shared=False,
+                      backend='auto'):
+    # Lazily read data is modified in memory.
+    TomoObj.materialize()
+    stage = _normalize_stage(TomoObj, cutoff)
+    if stage is None:
+        return
+    func, args, pars = stage
+
+    # Distribute jobs.
+    axis = 0 # Projection axis
+    report = TomoObj._start_report()
+    TomoObj._arrange_layout(axis, num_cores)
+    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, func, args,
+                                 axis, num_cores, chunk_size, shared,
+                                 pool=TomoObj.pool, backend=backend,
+                                 report=report)
+
+    # Update provenance.
+    TomoObj.provenance['normalize'] = pars
+
+    logger.info("normalization [ok]")
+    return TomoObj._finish_report('normalize', report)
+
+
+def _normalize_stage(TomoObj, cutoff=None):
     if not TomoObj.FLAG_DATA:
         logger.warning("normalization (data missing) [bypassed]")
         return
-        
+
     if not TomoObj.FLAG_WHITE:
         logger.warning("normalization (white-data missing) [bypassed]")
         return
-        
+
     if not TomoObj.FLAG_DARK:
         logger.warning("normalization (dark-data missing) [bypassed]")
         return
 
-    # Calculate average white and dark fields for normalization.
-    avg_white = np.mean(TomoObj.data_white, axis=0)
-    avg_dark = np.mean(TomoObj.data_dark, axis=0)
-    
+    # Average white and dark fields for normalization,
+    # unless already reduced while reading.
+    avg_white = TomoObj.avg_white
+    if avg_white is None:
+        avg_white = np.mean(TomoObj.data_white, axis=0)
+    avg_dark = TomoObj.avg_dark
+    if avg_dark is None:
+        avg_dark = np.mean(TomoObj.data_dark, axis=0)
+
+    args = (avg_white, avg_dark, cutoff)
+    return normalize, args, {'cutoff':cutoff}
+
+
+def phase_retrieval_wrapper(TomoObj, pixel_size=None, dist=None,
+                            energy=None, alpha=1e-5, padding=True,
+                            num_cores=None, chunk_size=None, shared=False,
+                            backend='auto'):
+    # Lazily read data is modified in memory.
+    TomoObj.materialize()
+    stage = _phase_retrieval_stage(TomoObj, pixel_size, dist,
+                                   energy, alpha, padding)
+    if stage is None:
+        return
+    func, args, pars = stage
+
     # Distribute jobs.
     axis = 0 # Projection axis
-    args = (avg_white, avg_dark, cutoff)
-    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, normalize, args,
-                                 axis, num_cores, chunk_size)
+    report = TomoObj._start_report()
+    TomoObj._arrange_layout(axis, num_cores)
+    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, func, args,
+                                 axis, num_cores, chunk_size, shared,
+                                 pool=TomoObj.pool, backend=backend,
+                                 report=report)
 
     # Update provenance.
-    TomoObj.provenance['normalize'] = {'cutoff':cutoff}
-    
-    logger.info("normalization [ok]")
+    TomoObj.provenance['phase_retrieval'] = pars
+
+    logger.info("phase retrieval [ok]")
+    return TomoObj._finish_report('phase_retrieval', report)
 
 
-def phase_retrieval_wrapper(TomoObj, pixel_size=None, dist=None, 
-                            energy=None, alpha=1e-5, padding=True,
-                            num_cores=None, chunk_size=None):
+def _phase_retrieval_stage(TomoObj, pixel_size=None, dist=None,
+                           energy=None, alpha=1e-5, padding=True):
     if not TomoObj.FLAG_DATA:
         logger.warning("phase retrieval (data missing) [bypassed]")
         return
-        
+
     if TomoObj.data.shape[1] < 16:
         logger.warning("phase retrieval (at least 16 slices are needed) [bypassed]")
         return
-        
+
     if pixel_size is None:
         logger.warning("phase retrieval (pixel_size missing) [bypassed]")
         return
-        
+
     if dist is None:
         logger.warning("phase retrieval (dist missing) [bypassed]")
         return
-        
+
     if energy is None:
         logger.warning("phase retrieval (energy missing) [bypassed]")
         return
-        
+
     # Compute the filter.
-    H, x_shift, y_shift, tmp_proj = phase_retrieval.paganin_filter(TomoObj.data,
-                                    pixel_size, dist, energy, alpha, padding)
-                                    
-                                    
+    H, x_shift, y_shift = phase_retrieval.paganin_filter(TomoObj.data,
+                          pixel_size, dist, energy, alpha, padding)
+
+    args = (H, x_shift, y_shift, padding)
+    return phase_retrieval.phase_retrieval, args, {'pixel_size':pixel_size,
+                                                   'dist':dist,
+                                                   'energy':energy,
+                                                   'alpha':alpha,
+                                                   'padding':padding}
+
+
+def stripe_removal_wrapper(TomoObj, level=None, wname='db5', sigma=4,
+                           num_cores=None, chunk_size=None, shared=False,
+                           backend='auto'):
+    # Lazily read data is modified in memory.
+    TomoObj.materialize()
+    stage = _stripe_removal_stage(TomoObj, level, wname, sigma)
+    if stage is None:
+        return
+    func, args, pars = stage
+
     # Distribute jobs.
-    axis = 0 # Projection axis
-    args = (H, x_shift, y_shift, tmp_proj, padding)
-    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, phase_retrieval.phase_retrieval, args,
-                                 axis, num_cores, chunk_size)
+    axis = 1 # Slice axis
+    report = TomoObj._start_report()
+    TomoObj._arrange_layout(axis, num_cores)
+    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, func, args,
+                                 axis, num_cores, chunk_size, shared,
+                                 pool=TomoObj.pool, backend=backend,
+                                 report=report)
 
     # Update provenance.
-    TomoObj.provenance['phase_retrieval'] = {'pixel_size':pixel_size, 
-	                                     'dist':dist,
-                                             'energy':energy,
-	                                     'alpha':alpha,
-	                                     'padding':padding}
-	    
-    logger.info("phase retrieval [ok]")
+    TomoObj.provenance['stripe_removal'] = pars
 
+    logger.info("stripe removal [ok]")
+    return TomoObj._finish_report('stripe_removal', report)
 
-def stripe_removal_wrapper(TomoObj, level=None, wname='db5', sigma=4,
-                           num_cores=None, chunk_size=None):
+
+def _stripe_removal_stage(TomoObj, level=None, wname='db5', sigma=4):
     if not TomoObj.FLAG_DATA:
         logger.warning("normalization (data missing) [bypassed]")
         return
@@ -113,27 +196,40 @@ def stripe_removal_wrapper(TomoObj, level=None, wname='db5', sigma=4,
     if level is None:
         size = np.max(TomoObj.data.shape)
         level = int(np.ceil(np.log2(size)))
-        
-    # Distribute jobs.
-    axis = 1 # Slice axis
+
     args = (level, wname, sigma)
-    TomoObj.data = multiprocess.distribute_jobs(TomoObj.data, stripe_removal, args,
-                                 axis, num_cores, chunk_size)
-    
-    # Update provenance.
-    TomoObj.provenance['stripe_removal'] = {'level':level, 
-                                            'wname':wname, 
-                                            'sigma':sigma}
-    
-    logger.info("stripe removal [ok]")
+    return stripe_removal, args, {'level':level,
+                                  'wname':wname,
+                                  'sigma':sigma}
+
+
+def pipeline_wrapper(TomoObj, operations,
+                     num_cores=None, chunk_size=None, shared=False,
+                     backend=None):
+    if not TomoObj.FLAG_DATA:
+        logger.warning("pipeline (data missing) [bypassed]")
+        return
+
+    report = TomoObj._start_report()
+    TomoObj.materialize()
+    run_pipeline(TomoObj, operations, num_cores, chunk_size, shared, backend,
+                 report)
+    return TomoObj._finish_report('pipeline', report)
+
 
+register_stage('median_filter', 1, _median_filter_stage)
+register_stage('normalize', 0, _normalize_stage)
+register_stage('phase_retrieval', 0, _phase_retrieval_stage)
+register_stage('stripe_removal', 1, _stripe_removal_stage)
 
 setattr(Dataset, 'median_filter', median_filter_wrapper)
 setattr(Dataset, 'normalize', normalize_wrapper)
 setattr(Dataset, 'phase_retrieval', phase_retrieval_wrapper)
 setattr(Dataset, 'stripe_removal', stripe_removal_wrapper)
+setattr(Dataset, 'pipeline', pipeline_wrapper)
 
 median_filter_wrapper.__doc__ = median_filter.__doc__
 normalize_wrapper.__doc__ = normalize.__doc__
-phase_retrieval_wrapper.__doc__ = phase_retrieval.__doc__
+phase_retrieval_wrapper.__doc__ = phase_retrieval.phase_retrieval.__doc__
 stripe_removal_wrapper.__doc__ = stripe_removal.__doc__
+pipeline_wrapper.__doc__ = run_pipeline.__doc__
@@ -3,7 +3,8 @@ import numpy as np
 import ctypes
 import os
 import time
-import multiprocessing as mp
+from tomopy.tools.layout import layout_of
+from tomopy.tools.affinity import available_cpus
 
 libpath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib/libgridrec.so'))
 libgridrec = ctypes.CDLL(libpath)
@@ -49,7 +50,8 @@ class GridrecCStruct(ctypes.Structure):
                 ("RiemannInterpolationCubic", ctypes.c_int),
                 ("RadonInterpolation", ctypes.c_int),
                 ("RadonInterpolationNone", ctypes.c_int),
-                ("RadonInterpolationLinear", ctypes.c_int)]
+                ("RadonInterpolationLinear", ctypes.c_int),
+                ("sinogramOrder", ctypes.c_int)]
 
 class Gridrec():
     def __init__(self,
@@ -62,7 +64,7 @@ class Gridrec():
                  fluorescence=0,
                  reconMethod=0,
                  reconMethodTomoRecon=0,
-                 numThreads=mp.cpu_count(),
+                 numThreads=None,
                  slicesPerChunk=32,
                  debugFileName='',
                  debug=0,
@@ -118,7 +120,8 @@ class Gridrec():
             0=tomoRecon, 1=Gridrec, 2=Backproject.
 
         numThreads : scalar
-            Number of threads.
+            Number of threads. Defaults to the number of CPUs
+            the process may run on, which respects pinning.
 
         slicesPerChunk : scalar
             Number of slices per chunk.
@@ -192,6 +195,8 @@ class Gridrec():
         self.params.reconMethodTomoRecon = 0
         self.params.reconMethodGridrec = 1
         self.params.reconMethodBackproject = 2
+        if numThreads is None:
+            numThreads = len(available_cpus())
         self.params.numThreads = numThreads
         self.params.slicesPerChunk = slicesPerChunk
         self.params.debug = 0
@@ -220,6 +225,7 @@ class Gridrec():
         self.params.RadonInterpolation = RadonInterpolation
         self.params.RadonInterpolationNone = 0
         self.params.RadonInterpolationLinear = 1
+        self.params.sinogramOrder = 0
 
     def run(self, data, center, theta, slice_no=None):
         """
@@ -252,13 +258,21 @@ class Gridrec():
         if np.array(center).size == 1:
             center = np.ones(num_slices) * center
 
+        # Select the input. Volumes stored as contiguous sinograms
+        # (see tomopy.tools.layout) are passed without a copy.
+        if slice_no is not None:
+            datain = np.ascontiguousarray(data[:, slice_no, :], dtype=np.float32)
+            self.params.sinogramOrder = 0
+        elif layout_of(data) == 'sinogram' and data.dtype == np.float32:
+            datain = np.transpose(data, (1, 0, 2))
+            self.params.sinogramOrder = 1
+        else:
+            datain = np.ascontiguousarray(data, dtype=np.float32)
+            self.params.sinogramOrder = 0
+
         # We want float32 inputs.
-        if not isinstance(data, np.float32):
-            data = data.astype(dtype=np.float32, copy=False)
-        if not isinstance(theta, np.float32):
-            theta = theta.astype(dtype=np.float32, copy=False)
-        if not isinstance(center, np.float32):
-            center = center.astype(dtype=np.float32, copy=False)
+        theta = np.asarray(theta, dtype=np.float32)
+        center = np.asarray(center, dtype=np.float32)
             
         # Construct the reconstruction object.
         libgridrec.reconCreate(ctypes.byref(self.params),
@@ -266,7 +280,6 @@ class Gridrec():
 
         # Prepare input variables by converting them to C-types.
         _num_slices = ctypes.c_int(num_slices)
-        datain = np.array(data[:, slice_no, :])
         self.data_recon = np.empty((num_slices,
                                     self.params.numPixels,
                                     self.params.numPixels), dtype=np.float32)
@@ -76,6 +76,11 @@ def optimize_center(data,
     # Use middle point of the detector area if the initial center is absent.
     if center_init is None:
         center_init = num_pixels / 2
+    
+    # Read the slice once if data is not in memory.
+    if not isinstance(data, np.ndarray):
+        data = data[:, slice_no:slice_no+1, :]
+        slice_no = 0
 
     # Make an initial reconstruction to adjust histogram limits. 
     recon = Gridrec(data)
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import os
 import shutil
 from tomopy.dataio.reader import Dataset
+from tomopy.tools.outofcore import is_resident, scratch_dataset, iter_slabs, \
+                                   Prefetcher, SlabWriter
+from tomopy.tools.multiprocess import schedule_chunks
 from gridrec import Gridrec
 from diagnose_center import diagnose_center
 from optimize_center import optimize_center
@@ -74,15 +78,105 @@ def gridrec_wrapper(TomoObj, *args, **kwargs):
     if not hasattr(TomoObj, 'center'):
         TomoObj.center = optimize_center(TomoObj.data, TomoObj.theta)
         
-    recon = Gridrec(TomoObj.data, *args, **kwargs)
-    recon.run(TomoObj.data, center=TomoObj.center, theta=TomoObj.theta)
-    TomoObj.data_recon = recon.data_recon
+    if getattr(TomoObj.pool, 'remote', False):
+        recon = _gridrec_distributed(TomoObj, *args, **kwargs)
+    elif is_resident(TomoObj.data):
+        # Gridrec reads contiguous sinograms without a copy.
+        TomoObj._arrange_layout(1)
+        recon = Gridrec(TomoObj.data, *args, **kwargs)
+        recon.run(TomoObj.data, center=TomoObj.center, theta=TomoObj.theta)
+        TomoObj.data_recon = recon.data_recon
+    else:
+        recon = _gridrec_out_of_core(TomoObj, *args, **kwargs)
     TomoObj.gridrec_pars = recon.params
     TomoObj.FLAG_DATA_RECON = True
     TomoObj.provenance['gridrec'] = (args, kwargs)
     logger.info("gridrec reconstruction [ok]")
 
 
+def _gridrec_out_of_core(TomoObj, *args, **kwargs):
+    # Reconstruct slabs of slices read from the data and store
+    # them in a scratch file, or in memory for lazy data. The
+    # next slab is read and the previous one written while the
+    # current one is reconstructed.
+    data = TomoObj.data
+    num_projections, num_slices, num_pixels = data.shape
+    if getattr(data, 'lazy', False):
+        TomoObj.data_recon = np.empty((num_slices, num_pixels, num_pixels),
+                                      dtype=np.float32)
+    else:
+        TomoObj.data_recon = scratch_dataset((num_slices, num_pixels, num_pixels),
+                                             'float32', TomoObj.scratch_dir)
+    center = np.asarray(TomoObj.center, dtype=np.float32)
+    
+    # Slabs are sized by the larger of input and output.
+    shape = (max(num_projections, num_pixels), num_slices, num_pixels)
+    reader = Prefetcher(lambda ind_start, ind_end: data[:, ind_start:ind_end, :],
+                        iter_slabs(shape, 1, 4))
+    writer = SlabWriter(_store_slices(TomoObj.data_recon))
+    try:
+        for ind_start, ind_end, slab in reader:
+            if center.size == 1:
+                slab_center = center
+            else:
+                slab_center = center[ind_start:ind_end]
+            recon = Gridrec(slab, *args, **kwargs)
+            recon.run(slab, center=slab_center, theta=TomoObj.theta)
+            writer.put(ind_start, ind_end, recon.data_recon)
+            logger.debug("gridrec slices %d-%d [ok]", ind_start, ind_end)
+    finally:
+        reader.close()
+        writer.close()
+    return recon
+
+
+def _gridrec_distributed(TomoObj, *args, **kwargs):
+    # Reconstruct slabs of slices on the nodes of the
+    # cluster in TomoObj.pool (see tools.distributed).
+    data = TomoObj.data
+    num_projections, num_slices, num_pixels = data.shape
+    if is_resident(data):
+        TomoObj.data_recon = np.empty((num_slices, num_pixels, num_pixels),
+                                      dtype=np.float32)
+    else:
+        TomoObj.data_recon = scratch_dataset((num_slices, num_pixels, num_pixels),
+                                             'float32', TomoObj.scratch_dir)
+    center = np.asarray(TomoObj.center, dtype=np.float32)
+    if center.size == 1:
+        center = np.ones(num_slices, dtype=np.float32) * center
+    
+    # Slabs are read ahead and written back
+    # while the nodes reconstruct.
+    chunks = schedule_chunks(num_slices, TomoObj.pool.num_cores)
+    reader = Prefetcher(lambda ind_start, ind_end:
+                        np.ascontiguousarray(data[:, ind_start:ind_end, :]), chunks)
+    writer = SlabWriter(_store_slices(TomoObj.data_recon))
+    jobs = ((slab, center[ind_start:ind_end], TomoObj.theta, args, kwargs)
+            for ind_start, ind_end, slab in reader)
+    try:
+        for index, data_recon in TomoObj.pool.imap(_gridrec_slab, jobs):
+            ind_start, ind_end = chunks[index]
+            writer.put(ind_start, ind_end, data_recon)
+            logger.debug("gridrec slices %d-%d [ok]", ind_start, ind_end)
+    finally:
+        reader.close()
+        writer.close()
+    return Gridrec(data, *args, **kwargs)
+
+
+def _store_slices(data_recon):
+    def write(ind_start, ind_end, slab):
+        data_recon[ind_start:ind_end] = slab
+    return write
+
+
+def _gridrec_slab(data, center, theta, args, kwargs):
+    # Runs on a node.
+    recon = Gridrec(data, *args, **kwargs)
+    recon.run(data, center=center, theta=theta)
+    return recon.data_recon
+
+
 setattr(Dataset, 'diagnose_center', diagnose_center_wrapper)
 setattr(Dataset, 'optimize_center', optimize_center_wrapper)
 setattr(Dataset, 'gridrec', gridrec_wrapper)
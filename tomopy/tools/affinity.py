@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+CPU and NUMA placement of worker processes.
+
+Pinning relies on ``os.sched_setaffinity`` and the NUMA topology
+is read from ``/sys/devices/system/node``, both Linux specific.
+Elsewhere all CPUs are taken as one node and pinning is a no-op.
+"""
+import multiprocessing as mp
+import glob
+import os
+import re
+
+
+def available_cpus():
+    """
+    CPUs the current process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(mp.cpu_count()))
+
+
+def numa_nodes():
+    """
+    Available CPUs grouped by NUMA node.
+
+    Returns
+    -------
+    out : dict
+        Sorted CPU lists keyed by node number.
+    """
+    cpus = set(available_cpus())
+    nodes = {}
+    for path in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+        node = int(re.search(r'node(\d+)', path).group(1))
+        try:
+            with open(path) as f:
+                node_cpus = cpus.intersection(_parse_cpulist(f.read()))
+        except (IOError, OSError, ValueError):
+            continue
+        if node_cpus:
+            nodes[node] = sorted(node_cpus)
+    if not nodes:
+        nodes = {0: sorted(cpus)}
+    return nodes
+
+
+def worker_cpus(num_workers):
+    """
+    Spread workers evenly over the available CPUs.
+
+    Workers are ordered by NUMA node and each node gets a
+    share proportional to its CPUs. CPUs are reused if there
+    are more workers than CPUs.
+
+    Returns
+    -------
+    out : list
+        ``(node, cpu)`` of each worker.
+    """
+    cpus = [(node, cpu) for node, node_cpus in sorted(numa_nodes().items())
+            for cpu in node_cpus]
+    return [cpus[m * len(cpus) // num_workers] for m in range(num_workers)]
+
+
+def pin(cpus):
+    """
+    Restrict the calling process to ``cpus``.
+
+    Returns
+    -------
+    out : bool
+        True if the affinity could be set.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _parse_cpulist(text):
+    # Parse lists like "0-3,8-11".
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
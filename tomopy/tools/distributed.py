@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Slab-decomposed execution across several nodes.
+
+Each node runs ``serve_node``, which accepts a coordinator over
+TCP and processes the slabs it receives with its own local
+worker pool. On the coordinator a ``Cluster`` connected to the
+nodes is used in place of a ``WorkerPool``, e.g. as
+``TomoObj.pool`` or the ``pool`` of ``distribute_jobs``, so the
+volume is split into slabs across nodes and each slab into
+chunks across the cores of its node. ``LocalCluster`` starts the
+nodes as local processes, which is handy for tests.
+
+A node is started with::
+
+    TOMOPY_AUTHKEY=secret python -m tomopy.tools.distributed host:port
+"""
+import multiprocessing as mp
+import atexit
+import os
+import socket
+import sys
+import time
+import traceback
+from multiprocessing.connection import Listener, Client
+from tomopy.tools.multiprocess import WorkerPool, distribute_jobs, kernel_name, _kernels
+import logging
+logger = logging.getLogger("tomopy")
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    # Python 2 has no connection.wait, but its
+    # connections are sockets, usable with select.
+    import select
+
+    def wait(conns, timeout=None):
+        return select.select(conns, [], [], timeout)[0]
+
+
+class Cluster(object):
+    """
+    Coordinator of a set of nodes running ``serve_node``.
+
+    The cluster follows the ``WorkerPool`` interface, with one
+    worker per node, so ``distribute_jobs`` hands slabs to nodes
+    in place of chunks to processes. Slabs go to the node with
+    the fewest slabs in flight. Shared memory is not available
+    across nodes, slabs are always sent over the connection.
+
+    Parameters
+    ----------
+    addresses : list
+        ``(host, port)`` of each node.
+
+    authkey : bytes, optional
+        Key authenticating the connections. Defaults to
+        the ``TOMOPY_AUTHKEY`` environment variable.
+    """
+    remote = True
+
+    def __init__(self, addresses, authkey=None):
+        if authkey is None:
+            authkey = _default_authkey()
+        self.addresses = [tuple(address) for address in addresses]
+        self.conns = [Client(address, authkey=authkey) for address in self.addresses]
+        self.num_cores = len(self.conns)
+        self.pending = [0] * self.num_cores
+        self._kernel = None
+        self._axis = None
+        self._halo = 0
+        self._dtype = None
+        atexit.register(self.shutdown)
+        logger.debug("cluster of %d nodes [ok]", self.num_cores)
+
+    def dispatch(self, func, axis=0, halo=0, dtype=None):
+        """
+        Select the kernel, the axis along which nodes split
+        their slabs, the halo of the kernel and the type of
+        the returned slabs for the following ``add_job`` calls.
+        """
+        if not self.is_alive():
+            raise RuntimeError("cluster is shut down")
+        name = func if isinstance(func, str) else kernel_name(func)
+        if name not in _kernels:
+            raise ValueError("unregistered kernel: %s" % name)
+        # Nodes look the kernel up in its module.
+        self._kernel = (_kernels[name].__name__, _kernels[name].__module__)
+        self._axis = axis
+        self._halo = halo
+        self._dtype = dtype
+        return self
+
+    def add_job(self, job):
+        self._send(('job', self._kernel, (self._axis, self._halo, self._dtype, job)))
+
+    def get_result(self):
+        """
+        Block until the next slab returns and return it as
+        ``(ind_start, ind_end, data, (start, end, node))``.
+        """
+        status, res = self._recv()
+        if status != 'ok':
+            self.close_out()
+            raise RuntimeError("cluster job failed:\n" + res)
+        return res
+
+    def close_out(self):
+        # Collect results but keep the nodes connected.
+        res_list = []
+        errors = []
+        while sum(self.pending) > 0:
+            status, res = self._recv()
+            if status != 'ok':
+                errors.append(res)
+            else:
+                res_list.append(res)
+        if errors:
+            raise RuntimeError("cluster job failed:\n" + errors[0])
+        return res_list
+
+    def imap(self, func, iterable, max_pending=None):
+        """
+        Call ``func`` on the nodes for each argument tuple.
+
+        Yields
+        ------
+        index, result
+            Position of the arguments in ``iterable`` and
+            the value returned by ``func``, as they complete.
+        """
+        if not self.is_alive():
+            raise RuntimeError("cluster is shut down")
+        if max_pending is None:
+            max_pending = 2 * self.num_cores
+        target = (func.__name__, func.__module__)
+        iterable = enumerate(iterable)
+        exhausted = False
+        while True:
+            while not exhausted and sum(self.pending) < max_pending:
+                try:
+                    index, args = next(iterable)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self._send(('call', target, (index, args)))
+            if sum(self.pending) == 0:
+                break
+            status, res = self._recv()
+            if status != 'ok':
+                try:
+                    self.close_out()
+                except RuntimeError:
+                    pass
+                raise RuntimeError("cluster call failed:\n" + res)
+            yield res
+
+    def _send(self, message):
+        node = self.pending.index(min(self.pending))
+        self.conns[node].send(message)
+        self.pending[node] += 1
+
+    def _recv(self):
+        # Sleep until a node with pending work answers
+        # or disconnects, which also wakes up wait.
+        busy = [conn for node, conn in enumerate(self.conns) if self.pending[node] > 0]
+        conn = wait(busy)[0]
+        node = self.conns.index(conn)
+        try:
+            res = conn.recv()
+        except EOFError:
+            self.shutdown()
+            raise RuntimeError("cluster node %s:%d disconnected"
+                               % self.addresses[node])
+        self.pending[node] -= 1
+        return res
+
+    def is_alive(self):
+        return self.conns is not None
+
+    def shutdown(self):
+        """
+        Disconnect from the nodes. Nodes started by a
+        ``LocalCluster`` stop, others wait for a new coordinator.
+        """
+        if self.conns is None:
+            return
+        for conn in self.conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except (IOError, OSError):
+                pass
+        self.conns = None
+
+
+class LocalCluster(Cluster):
+    """
+    ``Cluster`` of nodes started as local processes.
+
+    Parameters
+    ----------
+    num_nodes : scalar
+        Number of nodes.
+
+    num_cores : scalar, optional
+        Number of worker processes of each node. Defaults
+        to the available cores divided among the nodes.
+    """
+    def __init__(self, num_nodes, num_cores=None):
+        if num_cores is None:
+            num_cores = max(1, mp.cpu_count() // num_nodes)
+        authkey = os.urandom(16)
+        ready = mp.Queue()
+        self.p = [mp.Process(target=serve_node,
+                             args=(('localhost', 0), authkey, num_cores, ready, True))
+                  for m in range(num_nodes)]
+        # Nodes start worker processes of their own,
+        # so they can not be daemonic.
+        for process in self.p:
+            process.start()
+        addresses = [ready.get() for process in self.p]
+        super(LocalCluster, self).__init__(addresses, authkey)
+
+    def shutdown(self):
+        super(LocalCluster, self).shutdown()
+        if self.p is not None:
+            for process in self.p:
+                process.join()
+            self.p = None
+
+
+def serve_node(address, authkey=None, num_cores=None, ready=None, once=False):
+    """
+    Run a node: accept one coordinator at a time and process
+    its slabs until it disconnects.
+
+    Kernel slabs are split among ``num_cores`` local workers
+    with ``distribute_jobs``. Function calls (see ``Cluster.imap``)
+    run in the node process itself.
+
+    Parameters
+    ----------
+    address : tuple
+        ``(host, port)`` to listen on. Port 0 picks a free port.
+
+    authkey : bytes, optional
+        Key authenticating the coordinator. Defaults to
+        the ``TOMOPY_AUTHKEY`` environment variable.
+
+    num_cores : scalar, optional
+        Number of local worker processes.
+
+    ready : Queue, optional
+        Receives the listening address once the node is up.
+
+    once : bool, optional
+        Stop after the first coordinator disconnects.
+    """
+    if authkey is None:
+        authkey = _default_authkey()
+    listener = Listener(tuple(address), authkey=authkey)
+    if ready is not None:
+        ready.put(listener.address)
+    pool = WorkerPool(num_cores)
+    try:
+        while True:
+            conn = listener.accept()
+            _serve(conn, pool)
+            conn.close()
+            if once:
+                break
+    finally:
+        pool.shutdown()
+        listener.close()
+
+
+def _serve(conn, pool):
+    # Answer the messages of a coordinator until it disconnects.
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        kind, (name, module), payload = message
+        try:
+            func = _resolve(name, module)
+            if kind == 'job':
+                axis, halo, dtype, (data, args, ind_start, ind_end) = payload
+                tic = time.time()
+                data = distribute_jobs(data, func, args, axis, pool.num_cores,
+                                       None, pool=pool, backend='auto', halo=halo,
+                                       dtype=dtype)
+                res = ('ok', (ind_start, ind_end, data,
+                              (tic, time.time(), _node_id())))
+            else:
+                index, args = payload
+                res = ('ok', (index, func(*args)))
+        except Exception:
+            res = ('error', traceback.format_exc())
+        conn.send(res)
+
+
+def _node_id():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def _resolve(name, module):
+    # Import the defining module on first use.
+    if module not in sys.modules:
+        __import__(module)
+    return getattr(sys.modules[module], name)
+
+
+def _default_authkey():
+    authkey = os.environ.get('TOMOPY_AUTHKEY')
+    if authkey is None:
+        raise ValueError("authkey missing (set TOMOPY_AUTHKEY)")
+    return authkey.encode('utf-8') if not isinstance(authkey, bytes) else authkey
+
+
+if __name__ == '__main__':
+    host, port = sys.argv[1].rsplit(':', 1)
+    num_cores = None
+    if len(sys.argv) > 2:
+        num_cores = int(sys.argv[2])
+    serve_node((host, int(port)), num_cores=num_cores)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class Report(object):
+    """
+    Per-chunk and per-worker timings of distributed operations.
+
+    A report is filled by ``distribute_jobs`` when given as its
+    ``report`` argument, and may collect several calls, e.g. the
+    passes of a pipeline. Each chunk records:
+
+    - ``wait``: time between submitting the chunk and the start
+      of the kernel, spent in queues and (un)pickling,
+    - ``kernel_time``: run time of the kernel,
+    - ``result_wait``: time between the end of the kernel and
+      the arrival of its result,
+    - ``bytes_sent``, ``bytes_received``: size of the arrays and
+      arguments pickled to the worker and back (zero for threads
+      and serial runs),
+    - ``reassembly``: time spent writing the result back,
+    - ``worker``: the process, thread or node that ran it.
+
+    Times of chunks run on other nodes depend on their clocks.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.calls = []
+
+    def begin(self, name, backend, num_cores):
+        # Start recording a distribute_jobs call.
+        self.calls.append({'kernel':name,
+                           'backend':backend,
+                           'num_cores':num_cores,
+                           'wall_time':0.})
+
+    def end(self, wall_time):
+        self.calls[-1]['wall_time'] = wall_time
+
+    def add(self, ind_start, ind_end, submitted, stamp, received,
+            reassembly, bytes_sent, bytes_received):
+        started, finished, worker = stamp
+        self.chunks.append({'kernel':self.calls[-1]['kernel'],
+                            'ind_start':ind_start,
+                            'ind_end':ind_end,
+                            'worker':worker,
+                            'wait':max(started - submitted, 0.),
+                            'kernel_time':finished - started,
+                            'result_wait':max(received - finished, 0.),
+                            'reassembly':reassembly,
+                            'bytes_sent':bytes_sent,
+                            'bytes_received':bytes_received})
+
+    def workers(self):
+        """
+        Aggregate the chunks by worker.
+
+        Returns
+        -------
+        out : dict
+            For each worker the number of chunks, and the
+            total kernel time, wait and bytes transferred.
+        """
+        out = {}
+        for chunk in self.chunks:
+            w = out.setdefault(chunk['worker'], {'chunks':0,
+                                                 'kernel_time':0.,
+                                                 'wait':0.,
+                                                 'bytes':0})
+            w['chunks'] += 1
+            w['kernel_time'] += chunk['kernel_time']
+            w['wait'] += chunk['wait']
+            w['bytes'] += chunk['bytes_sent'] + chunk['bytes_received']
+        return out
+
+    def summary(self):
+        """
+        Totals of the report, suitable for provenance.
+
+        ``imbalance`` is the busiest worker's kernel time over
+        the mean kernel time per worker, ``straggler`` that worker.
+        """
+        workers = self.workers()
+        busy = dict((name, w['kernel_time']) for name, w in workers.items())
+        out = {'calls':[(call['kernel'], call['backend'], call['num_cores'])
+                        for call in self.calls],
+               'wall_time':sum(call['wall_time'] for call in self.calls),
+               'chunks':len(self.chunks),
+               'workers':len(workers),
+               'kernel_time':_total(self.chunks, 'kernel_time'),
+               'wait':_total(self.chunks, 'wait'),
+               'max_wait':max([c['wait'] for c in self.chunks] or [0.]),
+               'reassembly':_total(self.chunks, 'reassembly'),
+               'bytes_sent':_total(self.chunks, 'bytes_sent'),
+               'bytes_received':_total(self.chunks, 'bytes_received'),
+               'straggler':None,
+               'imbalance':1.}
+        if busy and sum(busy.values()) > 0:
+            out['straggler'] = max(busy, key=busy.get)
+            out['imbalance'] = float(max(busy.values()) / np.mean(list(busy.values())))
+        return out
+
+    def __str__(self):
+        s = self.summary()
+        lines = ["%d chunks on %d workers in %.3f s" % (s['chunks'], s['workers'],
+                                                         s['wall_time']),
+                 "kernel %.3f s, wait %.3f s (max %.3f s), reassembly %.3f s"
+                 % (s['kernel_time'], s['wait'], s['max_wait'], s['reassembly']),
+                 "sent %d bytes, received %d bytes" % (s['bytes_sent'],
+                                                      s['bytes_received'])]
+        for name, w in sorted(self.workers().items()):
+            lines.append("  %s: %d chunks, kernel %.3f s, wait %.3f s"
+                         % (name, w['chunks'], w['kernel_time'], w['wait']))
+        return "\n".join(lines)
+
+
+def _total(chunks, key):
+    return sum(chunk[key] for chunk in chunks)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import numpy as np
+import threading
+from tomopy.tools.multiprocess import shared_array, is_shared
+
+
+# Edge length of the (projection, slice) tiles used
+# when changing the memory order of a volume.
+_BLOCK_SIZE = 64
+
+
+def layout_of(data):
+    """
+    Memory order of a [projections, slices, pixels] volume.
+
+    Returns
+    -------
+    out : str
+        ``'projection'`` if projections are contiguous,
+        ``'sinogram'`` if the volume is a view of a contiguous
+        [slices, projections, pixels] array and None otherwise.
+    """
+    if not isinstance(data, np.ndarray) or data.ndim != 3:
+        return None
+    if data.flags.c_contiguous:
+        return 'projection'
+    if np.transpose(data, (1, 0, 2)).flags.c_contiguous:
+        return 'sinogram'
+    return None
+
+
+def to_layout(data, layout, num_cores=None):
+    """
+    Store a volume in the given memory order.
+
+    The result is indexed as [projections, slices, pixels]
+    like ``data``. In the ``'sinogram'`` order it is a view of
+    a contiguous [slices, projections, pixels] array, so slice
+    chunks and sinograms are contiguous. The copy is done in
+    cache-sized tiles by ``num_cores`` threads and needs memory
+    for a second volume while it runs. Shared arrays stay
+    shared.
+
+    Parameters
+    ----------
+    data : ndarray
+        3-D volume.
+
+    layout : str
+        ``'projection'`` or ``'sinogram'``.
+
+    num_cores : scalar, optional
+        Number of threads. Defaults to the number of
+        available cores.
+
+    Returns
+    -------
+    out : ndarray
+        ``data`` itself if it is already in the requested order,
+        otherwise its reordered copy.
+    """
+    if layout not in ('projection', 'sinogram'):
+        raise ValueError("unknown layout: %s" % layout)
+    if layout_of(data) == layout:
+        return data
+
+    num_projections, num_slices, num_pixels = data.shape
+    if layout == 'sinogram':
+        shape = (num_slices, num_projections, num_pixels)
+    else:
+        shape = data.shape
+    if is_shared(data):
+        buf = shared_array(shape, data.dtype)
+    else:
+        buf = np.empty(shape, dtype=data.dtype)
+    if layout == 'sinogram':
+        out = np.transpose(buf, (1, 0, 2))
+    else:
+        out = buf
+
+    # Threads take slice blocks, each copying tiles
+    # of projections so that reads and writes stay
+    # within the cache.
+    if num_cores is None:
+        num_cores = mp.cpu_count()
+    blocks = [(m, min(m+_BLOCK_SIZE, num_slices))
+              for m in range(0, num_slices, _BLOCK_SIZE)]
+
+    def copy_blocks(blocks):
+        for ind_start, ind_end in blocks:
+            for m in range(0, num_projections, _BLOCK_SIZE):
+                n = min(m+_BLOCK_SIZE, num_projections)
+                out[m:n, ind_start:ind_end, :] = data[m:n, ind_start:ind_end, :]
+
+    threads = [threading.Thread(target=copy_blocks, args=(blocks[m::num_cores],))
+               for m in range(min(num_cores, len(blocks)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return out
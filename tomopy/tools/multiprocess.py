@@ -1,16 +1,50 @@
 # -*- coding: utf-8 -*-
 import multiprocessing as mp
+import numpy as np
+import atexit
+import functools
+import pickle
+import os
+import tempfile
+import threading
+import time
+import traceback
+from tomopy.tools.affinity import worker_cpus, pin
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+# Kernels decorated with @worker, by ``kernel_name``.
+_kernels = {}
+
+# Seconds between worker health checks while
+# waiting for results.
+_POLL_INTERVAL = 1.0
+
+# Smallest chunk run time (in seconds) targeted by the
+# adaptive scheduler to amortize dispatch overhead.
+_MIN_CHUNK_TIME = 0.05
+
+# Default chunk size in bytes for volumes streamed from disk.
+_OUT_OF_CORE_CHUNK_BYTES = 64 * 2**20
 
 
 class multiprocess(object):
-    def __init__(self, target_func, num_cores=mp.cpu_count(), **kwargs):
+    def __init__(self, target_func, num_cores=mp.cpu_count(), shared=None, **kwargs):
         self.total_jobs = 0
+        self.completed_jobs = 0
         self.jobs = mp.JoinableQueue()
         self.results = mp.Queue()
 
+        # Workers map the shared buffer themselves when
+        # its descriptor is given.
         tup = (self.jobs, self.results)
+        if shared is not None:
+            tup += (shared,)
         self.num_cores = num_cores
-        self.p = [mp.Process(target=target_func, 
+        self.p = [mp.Process(target=target_func,
                              args=tup) for i in range(num_cores)]
 
         for process in self.p:
@@ -20,106 +54,1031 @@ class multiprocess(object):
         self.total_jobs += 1
         self.jobs.put(job)
 
+    def get_result(self):
+        """
+        Block until the next result arrives and return it.
+        """
+        while True:
+            try:
+                res = self.results.get(timeout=_POLL_INTERVAL)
+                break
+            except Empty:
+                # Kernel exceptions end the worker process.
+                if any(process.exitcode for process in self.p):
+                    self.terminate()
+                    raise RuntimeError("worker process failed")
+        self.completed_jobs += 1
+        return res
+
     def close_out(self):
         # Add Poison Pills
         for i in range(self.num_cores):
             self.jobs.put((None,))
 
-        completed_jobs = 0
         res_list = []
-        while True:
-            if not self.results.empty():
-                res_list.append(self.results.get())
-                completed_jobs += 1
-            if completed_jobs==self.total_jobs:
-                break
-        
+        while self.completed_jobs < self.total_jobs:
+            res_list.append(self.get_result())
+
         self.jobs.join()
         self.jobs.close()
         self.results.close()
 
         for process in self.p:
             process.join()
-            
+
         return res_list
 
+    def terminate(self):
+        for process in self.p:
+            process.terminate()
+
 
 def worker(func):
+    @functools.wraps(func)
     def worker_in(*args, **kwargs):
 	#name = mp.current_process().name
         jobs_completed = 0
         jobs, results = args[0], args[1]
+
+        # Map the shared volume once per process.
+        data, desc = None, None
+        if len(args) > 2:
+            desc = args[2]
+            data = _attach_shared(desc)
+
         while True:
             job_args = jobs.get()
             if job_args[0] is None: # Deal with Poison Pill
                 #print '{}: Exiting. {:d} jobs completed.'.format(name, jobs_completed)
                 jobs.task_done()
                 break
-            res = func(job_args)
+            res = _run_job(func, job_args, data, desc)
             jobs_completed += 1
             jobs.task_done()
             results.put(res)
         return worker_in
+    worker_in.kernel = func
+    _kernels[kernel_name(func)] = func
     return worker_in
 
 
-def distribute_jobs(data, func, args, axis, num_cores, chunk_size):
+def kernel_name(func):
+    """
+    Name a kernel is registered as, ``module.name``, so that
+    kernels of the same name in different modules are kept
+    apart.
+    """
+    return func.__module__ + '.' + func.__name__
+
+
+@worker
+def first_touch(args):
+    """
+    Zero a chunk of a shared buffer, allocating its pages
+    on the NUMA node of the worker.
+    """
+    data, args, ind_start, ind_end = args
+    data[...] = 0
+    return ind_start, ind_end, data
+
+
+def get_kernel(name):
+    """
+    Return the undecorated kernel registered as ``name``
+    (see ``kernel_name``), importing its module if needed.
+    """
+    if name not in _kernels:
+        __import__(name.rsplit('.', 1)[0])
+    return _kernels[name]
+
+
+def _run_job(func, job_args, data=None, desc=None):
+    # Results carry when and where the kernel
+    # ran, as (start, end, worker), last.
+    tic = time.time()
+    if data is None:
+        res = func(job_args)
+        return res[0], res[1], res[2], (tic, time.time(), _worker_id())
+
+    # Only indices travel through the queue. Kernels
+    # work on views and write their results in place.
+    ind_start, ind_end, func_args = job_args
+    axis, out, halo = desc[3], desc[5], desc[6]
+    if out is None:
+        chunk = _chunk(data, axis, ind_start, ind_end)
+        res = func((chunk, func_args, ind_start, ind_end))
+        if res[2] is not chunk:
+            chunk[...] = res[2]
+        return ind_start, ind_end, None, (tic, time.time(), _worker_id())
+
+    # With an output buffer (for a halo or another dtype) the
+    # kernel gets a copy of the chunk, extended by the halo,
+    # and only the interior is written, into the buffer.
+    ext_start, ext_end = _extend(ind_start, ind_end, halo, data.shape[axis])
+    chunk = np.array(_chunk(data, axis, ext_start, ext_end))
+    res = func((chunk, func_args, ext_start, ext_end))
+    # The buffer is mapped for this job only, so that no worker
+    # keeps it mapped once the operation is over.
+    _chunk(_attach_shared(out), axis, ind_start, ind_end)[...] = \
+        _chunk(res[2], axis, ind_start - ext_start, ind_end - ext_start)
+    return ind_start, ind_end, None, (tic, time.time(), _worker_id())
+
+
+def _extend(ind_start, ind_end, halo, dims):
+    # Chunk range grown by the halo on both sides.
+    return max(ind_start - halo, 0), min(ind_end + halo, dims)
+
+
+def _worker_id():
+    return "%s/%s" % (mp.current_process().name, threading.current_thread().name)
+
+
+class multithread(object):
+    """
+    Thread based counterpart of ``multiprocess``.
+
+    Threads run the kernel directly on views of the volume,
+    so nothing is pickled and results are written in place.
+    Suited to kernels that spend their time in routines
+    releasing the GIL.
+    """
+    def __init__(self, target_func, num_cores=mp.cpu_count()):
+        self.total_jobs = 0
+        self.completed_jobs = 0
+        self.jobs = Queue()
+        self.results = Queue()
+        self.num_cores = num_cores
+        self.p = [threading.Thread(target=self._run,
+                                   args=(target_func.kernel,)) for i in range(num_cores)]
+        for thread in self.p:
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, func):
+        while True:
+            job_args = self.jobs.get()
+            if job_args is None: # Poison Pill
+                break
+            try:
+                res = _run_job(func, job_args)
+            except Exception:
+                res = (None, None, traceback.format_exc())
+            self.results.put(res)
+
+    def add_job(self, job):
+        self.total_jobs += 1
+        self.jobs.put(job)
+
+    def get_result(self):
+        res = self.results.get()
+        self.completed_jobs += 1
+        if res[0] is None:
+            self.terminate()
+            raise RuntimeError("worker thread failed:\n" + res[2])
+        return res
+
+    def close_out(self):
+        res_list = []
+        while self.completed_jobs < self.total_jobs:
+            res_list.append(self.get_result())
+        self.terminate()
+        return res_list
+
+    def terminate(self):
+        # Threads can not be killed, let them finish
+        # the queued jobs and stop.
+        for thread in self.p:
+            self.jobs.put(None)
+
+
+class serial(object):
+    """
+    Run jobs one by one in the calling thread.
+    """
+    def __init__(self, target_func):
+        self.func = target_func.kernel
+        self.jobs = []
+
+    def add_job(self, job):
+        self.jobs.append(job)
+
+    def get_result(self):
+        return _run_job(self.func, self.jobs.pop(0))
+
+    def close_out(self):
+        res_list = []
+        while self.jobs:
+            res_list.append(self.get_result())
+        return res_list
+
+    def terminate(self):
+        self.jobs = []
+
+
+class WorkerPool(object):
+    """
+    Long-lived pool of worker processes.
+
+    Unlike ``multiprocess``, the processes survive across
+    operations and run any kernel registered with ``@worker``
+    by name, so process start-up is paid only once. The pool
+    is shut down with ``shutdown`` or at interpreter exit.
+
+    With ``affinity`` each worker is pinned to a CPU (see
+    ``tools.affinity``, Linux only) and workers are grouped by
+    NUMA node. The volume is then split into one contiguous
+    range per node, in proportion to its workers, and chunks
+    only go to workers of the node owning their range. Shared
+    buffers created for such a pool are first touched by these
+    workers, so their pages reside on the node processing them.
+
+    Parameters
+    ----------
+    num_cores : scalar, optional
+        Number of worker processes. Defaults to the
+        number of available cores.
+
+    affinity : bool, optional
+        Pin workers and keep chunks on their NUMA node.
+    """
+    def __init__(self, num_cores=None, affinity=False):
+        if num_cores is None:
+            num_cores = mp.cpu_count()
+        self.num_cores = num_cores
+        self.affinity = affinity
+        self.total_jobs = 0
+        self.completed_jobs = 0
+        self.results = mp.Queue()
+        self._kernel = None
+        self._shared = None
+        self._dims = None
+
+        # One job queue per NUMA node.
+        if affinity:
+            placement = worker_cpus(num_cores)
+        else:
+            placement = [(0, None)] * num_cores
+        nodes = sorted(set(node for node, cpu in placement))
+        self.jobs = [mp.Queue() for node in nodes]
+        workers = [nodes.index(node) for node, cpu in placement]
+        self._bounds = [float(sum(1 for w in workers if w <= m)) / num_cores
+                        for m in range(len(nodes))]
+
+        self.p = [mp.Process(target=_pool_worker,
+                             args=(self.jobs[workers[i]], self.results, placement[i][1]))
+                  for i in range(num_cores)]
+        self._queue_of = workers
+        for process in self.p:
+            process.daemon = True
+            process.start()
+        atexit.register(self.shutdown)
+
+    def dispatch(self, func, shared=None, dims=None):
+        """
+        Select the kernel, the shared buffer descriptor and the
+        length of the chunked axis used by the following
+        ``add_job`` calls.
+        """
+        if not self.is_alive():
+            raise RuntimeError("worker pool is shut down")
+        name = func if isinstance(func, str) else kernel_name(func)
+        if name not in _kernels:
+            raise ValueError("unregistered kernel: %s" % name)
+        self._kernel = (name, _kernels[name].__module__)
+        self._shared = shared
+        self._dims = dims
+        return self
+
+    def add_job(self, job):
+        self.total_jobs += 1
+        self._queue(job).put((self._kernel, self._shared, job))
+
+    def _queue(self, job):
+        # Queue of the NUMA node owning the chunk.
+        if len(self.jobs) == 1 or not self._dims:
+            return self.jobs[0]
+        if self._shared is None:
+            ind_start = job[2]
+        else:
+            ind_start = job[0]
+        for m, bound in enumerate(self._bounds):
+            if ind_start < bound * self._dims:
+                return self.jobs[m]
+        return self.jobs[-1]
+
+    def get_result(self):
+        """
+        Block until the next result arrives and return it.
+        """
+        res = self._next_result()
+        if res[0] is None:
+            # Drain the jobs still running so that the
+            # pool is clean for the next operation.
+            self.close_out()
+            raise RuntimeError("worker pool job failed:\n" + res[2])
+        return res
+
+    def close_out(self):
+        # Collect results but keep the workers running.
+        res_list = []
+        errors = []
+        while self.completed_jobs < self.total_jobs:
+            res = self._next_result()
+            if res[0] is None:
+                errors.append(res[2])
+            else:
+                res_list.append(res)
+        self.total_jobs = 0
+        self.completed_jobs = 0
+        if errors:
+            raise RuntimeError("worker pool job failed:\n" + errors[0])
+        return res_list
+
+    def _next_result(self):
+        # Wait for a result, checking that no worker died
+        # meanwhile, as its jobs would never complete.
+        while True:
+            try:
+                res = self.results.get(timeout=_POLL_INTERVAL)
+                break
+            except Empty:
+                if not all(process.is_alive() for process in self.p):
+                    self.shutdown()
+                    raise RuntimeError("worker pool process died")
+        self.completed_jobs += 1
+        return res
+
+    def is_alive(self):
+        return self.p is not None
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        if self.p is None:
+            return
+        for m in self._queue_of:
+            self.jobs[m].put(None)
+        for process in self.p:
+            process.join()
+        for jobs in self.jobs:
+            jobs.close()
+        self.results.close()
+        self.p = None
+
+
+def _pool_worker(jobs, results, cpu=None):
+    if cpu is not None:
+        pin([cpu])
+
+    # The shared buffer is mapped for each job and unmapped
+    # right after, so that idle workers keep no buffer alive.
+    data = None
+    while True:
+        job = jobs.get()
+        if job is None: # Poison Pill
+            break
+        (name, module), shared, job_args = job
+        try:
+            if name not in _kernels:
+                __import__(module)
+            if shared is not None:
+                data = _attach_shared(shared)
+            res = _run_job(_kernels[name], job_args, data, shared)
+        except Exception:
+            res = (None, None, traceback.format_exc())
+        data = None
+        results.put(res)
+
+
+class CostModel(object):
+    """
+    Per-index run times of kernels from previous runs.
+
+    Timings are kept per kernel, chunking axis and shape of
+    the remaining axes. Volumes of similar shape, i.e. differing
+    only in length along the chunking axis, reuse the recorded
+    profile resampled to the new length.
+    """
+    def __init__(self):
+        self._profiles = {}
+        self._backends = {}
+
+    def _key(self, name, shape, axis):
+        other = tuple(shape[m] for m in range(len(shape)) if m != axis)
+        return (name, axis, other)
+
+    def record(self, name, shape, axis, timings):
+        """
+        Store a profile from ``(ind_start, ind_end, elapsed)`` chunk timings.
+        """
+        profile = np.zeros(shape[axis])
+        for ind_start, ind_end, elapsed in timings:
+            profile[ind_start:ind_end] = elapsed / (ind_end - ind_start)
+        self._profiles[self._key(name, shape, axis)] = profile
+
+    def profile(self, name, shape, axis):
+        """
+        Return the estimated run time of each index along
+        ``axis``, or None if the kernel has not been timed.
+        """
+        profile = self._profiles.get(self._key(name, shape, axis))
+        if profile is None:
+            return None
+        dims = shape[axis]
+        if profile.size != dims:
+            profile = np.interp(np.linspace(0, profile.size-1, dims),
+                                np.arange(profile.size), profile)
+        return profile
+
+    def record_backend(self, name, shape, axis, backend, elapsed):
+        """
+        Store the total run time of a kernel with a backend.
+        """
+        key = self._key(name, shape, axis)
+        self._backends.setdefault(key, {})[backend] = elapsed / shape[axis]
+
+    def best_backend(self, name, shape, axis, preferred='processes',
+                     thread_safe=True):
+        """
+        Choose a backend for a kernel from measured run times.
+
+        The ``preferred`` backend is used until it has been
+        timed, then the alternative is tried once and from
+        then on the faster of the two is returned. Kernels
+        that are not ``thread_safe`` always run on processes.
+        """
+        if not thread_safe:
+            return 'processes'
+        measured = self._backends.get(self._key(name, shape, axis), {})
+        candidates = (preferred, 'processes', 'threads')
+        for backend in candidates:
+            if backend not in measured:
+                return backend
+        return min(candidates, key=measured.get)
+
+    def clear(self):
+        self._profiles.clear()
+        self._backends.clear()
+
+
+# Timings shared by all distributed operations.
+cost_model = CostModel()
+
+
+def schedule_chunks(dims, num_cores, chunk_size=None, cost=None, min_cost=1):
+    """
+    Split ``range(dims)`` into chunks of ``(ind_start, ind_end)``.
+
+    With ``chunk_size`` the chunks have a fixed size. Otherwise
+    chunks are guided: each one takes ``1/(2*num_cores)`` of the
+    remaining cost, but not less than ``min_cost``, so chunks
+    start large and shrink as the queue drains and no core
+    is left waiting for a single large tail chunk.
+
+    Parameters
+    ----------
+    dims : scalar
+        Length of the chunking axis.
+
+    num_cores : scalar
+        Number of workers sharing the chunks.
+
+    chunk_size : scalar, optional
+        Fixed chunk size.
+
+    cost : ndarray, optional
+        Estimated cost of each index. Uniform if not given.
+
+    min_cost : scalar, optional
+        Smallest cost of a guided chunk.
+    """
+    if chunk_size is not None:
+        return [(m, min(m+chunk_size, dims)) for m in range(0, dims, chunk_size)]
+
+    if cost is None:
+        cost = np.ones(dims)
+    cum_cost = np.cumsum(cost)
+    total_cost = cum_cost[-1]
+
+    chunks = []
+    ind_start = 0
+    done = 0.
+    while ind_start < dims:
+        target = max((total_cost - done) / (2. * num_cores), min_cost)
+        ind_end = int(np.searchsorted(cum_cost, done + target)) + 1
+        ind_end = min(max(ind_end, ind_start + 1), dims)
+        chunks.append((ind_start, ind_end))
+        done = cum_cost[ind_end-1]
+        ind_start = ind_end
+    return chunks
+
+
+def shared_array(shape, dtype='float32'):
+    """
+    Allocate an array in a shared, file-backed buffer.
+
+    The buffer is placed in ``/dev/shm`` when it has room for
+    the array (see ``shm_has_room``), otherwise in the default
+    temporary directory, so that worker processes can map the
+    same memory instead of receiving pickled chunks. The
+    backing file is removed when the array is garbage collected.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+
+    dtype : str, optional
+        Data type of the array.
+
+    Returns
+    -------
+    out : memmap
+        Zero initialized shared array.
+    """
+    shm_dir = None
+    if shm_has_room(int(np.prod(shape)) * np.dtype(dtype).itemsize):
+        shm_dir = '/dev/shm'
+    fd, file_name = tempfile.mkstemp(prefix='tomopy-', suffix='.shm', dir=shm_dir)
+    os.close(fd)
+    arr = np.memmap(file_name, dtype=dtype, mode='w+', shape=tuple(shape))
+    arr._shared_file = _SharedFile(file_name)
+    return arr
+
+
+def shm_has_room(nbytes):
+    """
+    Check if ``/dev/shm`` is writable and has ``nbytes`` free.
+    Writes past the free space of tmpfs raise SIGBUS.
+    """
+    shm_dir = '/dev/shm'
+    if not os.path.isdir(shm_dir) or not os.access(shm_dir, os.W_OK):
+        return False
+    st = os.statvfs(shm_dir)
+    return st.f_bavail * st.f_frsize >= nbytes
+
+
+def map_file(file_name, shape, dtype='float32', offset=0):
+    """
+    Map a binary input file as a shared array.
+
+    Pages are read from the file only as they are touched, and
+    worker processes map the same file read-only (see
+    ``shared_array``) instead of receiving pickled chunks. The
+    file is never written: changes to the array stay private
+    to the calling process, and ``distribute_jobs`` writes the
+    results of kernels to a new array.
+
+    Parameters
+    ----------
+    file_name : str
+        Binary file holding the array in C order.
+
+    shape : tuple
+        Shape of the array.
+
+    dtype : str, optional
+        Data type of the array.
+
+    offset : scalar, optional
+        Position of the array in the file in bytes.
+
+    Returns
+    -------
+    out : memmap
+        Copy-on-write mapping of the file.
+    """
+    file_name = os.path.abspath(file_name)
+    arr = np.memmap(file_name, dtype=dtype, mode='c', offset=offset,
+                    shape=tuple(shape))
+    arr._shared_file = _SharedFile(file_name, offset, 'r', owned=False)
+    return arr
+
+
+def is_shared(data):
+    """
+    Check if ``data`` is an array created by ``shared_array``
+    or its sinogram ordered view (see ``tools.layout``).
+    """
+    return _shared_base(data) is not None
+
+
+def _shared_base(data):
+    # The shared buffer behind data and whether data
+    # is its [slices, projections, pixels] transpose.
+    if getattr(data, '_shared_file', None) is not None:
+        return data, False
+    base = getattr(data, 'base', None)
+    if getattr(base, '_shared_file', None) is not None and data.ndim == 3:
+        view = np.transpose(data, (1, 0, 2))
+        if view.shape == base.shape and view.strides == base.strides and \
+           view.ctypes.data == base.ctypes.data:
+            return base, True
+    return None
+
+
+def _to_shared(data, axis=0, pool=None):
+    # Copy data into a shared buffer of the same memory order.
+    buf = _empty_shared_like(data, axis, pool)
+    buf[...] = data
+    return buf
+
+
+def _empty_shared_like(data, axis=0, pool=None, dtype=None):
+    if dtype is None:
+        dtype = data.dtype
+    if data.ndim == 3 and not data.flags.c_contiguous and \
+       np.transpose(data, (1, 0, 2)).flags.c_contiguous:
+        buf = np.transpose(shared_array((data.shape[1], data.shape[0], data.shape[2]),
+                                        dtype), (1, 0, 2))
+    else:
+        buf = shared_array(data.shape, dtype)
+
+    # Pages are placed on the NUMA node that first writes them.
+    if getattr(pool, 'affinity', False) and len(pool.jobs) > 1:
+        for progress in imap_jobs(buf, first_touch, None, axis, shared=True,
+                                  pool=pool, schedule='static'):
+            pass
+    return buf
+
+
+class _SharedFile(object):
+    """
+    File backing a shared array, removed with the array
+    if ``owned``. Workers map it with ``mode`` from ``offset``.
+    """
+    def __init__(self, file_name, offset=0, mode='r+', owned=True):
+        self.file_name = file_name
+        self.offset = offset
+        self.mode = mode
+        self.owned = owned
+
+    def __del__(self):
+        # Processes that already mapped the file keep their pages.
+        if not self.owned:
+            return
+        try:
+            os.remove(self.file_name)
+        except OSError:
+            pass
+
+
+def _read_only(data):
+    # Arrays mapped from input files (see map_file).
+    base = _shared_base(data)
+    return base is not None and base[0]._shared_file.mode == 'r'
+
+
+def _shared_desc(data, axis, out=None, halo=0):
+    # ((file, offset, mode), dtype, shape, axis, transposed,
+    #  output descriptor, halo)
+    base, transposed = _shared_base(data)
+    if out is not None:
+        out = _shared_desc(out, axis)[0:5]
+    f = base._shared_file
+    return ((f.file_name, f.offset, f.mode), base.dtype.str, base.shape, axis,
+            transposed, out, halo)
+
+
+def _attach_shared(desc):
+    (file_name, offset, mode), dtype, shape = desc[0:3]
+    data = np.memmap(file_name, dtype=dtype, mode=mode, offset=offset, shape=shape)
+    if desc[4]:
+        data = np.transpose(data, (1, 0, 2))
+    return data
+
+
+def _chunk(data, axis, ind_start, ind_end):
+    # View of data along the given axis.
+    slc = [slice(None)] * data.ndim
+    slc[axis] = slice(ind_start, ind_end)
+    return data[tuple(slc)]
+
+
+def _store(data, axis, ind_start, ind_end, res):
+    # Write a chunk into an array or an HDF5 dataset.
+    slc = [slice(None)] * data.ndim
+    slc[axis] = slice(ind_start, ind_end)
+    data[tuple(slc)] = res
+
+
+def distribute_jobs(data, func, args, axis, num_cores, chunk_size, shared=False,
+                    pool=None, callback=None, schedule='adaptive',
+                    backend='processes', report=None, halo=None, dtype=None):
     """
     Distribute 3-D volume jobs in chunks into cores.
+
+    If ``shared`` is True the volume is moved into a shared
+    buffer (see ``shared_array``) and only chunk indices are
+    sent to workers, which write their results in place.
+    The returned array is then the shared buffer.
+
+    If a ``WorkerPool`` is given as ``pool`` its processes are
+    used instead of starting new ones. A ``Cluster`` (see
+    ``tools.distributed``) sends the chunks to its nodes as
+    slabs, on which they run with the processes backend.
+
+    If given, ``callback(ind_start, ind_end, completed, total)``
+    is called as soon as each chunk is written back.
+
+    ``schedule`` is one of ``'static'`` (equal chunks, one per
+    core), ``'guided'`` (shrinking chunks, see ``schedule_chunks``)
+    or ``'adaptive'`` (guided, with chunks balanced by the timings
+    of previous runs of the same kernel). A given ``chunk_size``
+    always gives equal chunks.
+
+    ``backend`` selects where chunks run: ``'processes'``,
+    ``'threads'`` (in place on views of ``data``, ``shared`` and
+    ``pool`` are ignored), ``'serial'`` or ``'auto'``, which
+    starts with the backend preferred by the kernel (its
+    ``backend`` attribute) and then keeps the fastest one
+    measured for the kernel and data shape. Kernels whose
+    ``thread_safe`` attribute is False run on processes
+    instead of threads.
+
+    ``data`` may also be an HDF5 dataset (see ``tools.outofcore``),
+    in which case chunks are read from it and written back one
+    by one, so only the chunks in flight are held in memory.
+    ``shared`` is then ignored.
+
+    If a ``Report`` (see ``tools.instrument``) is given as
+    ``report``, the timings and transferred bytes of every
+    chunk are recorded in it.
+
+    Arrays mapped from input files (see ``map_file``) are
+    shared as they are, and results go to a new array.
+
+    ``halo`` is the number of neighbouring indices along ``axis``
+    a kernel needs on each side of its chunk (by default its
+    ``halo`` attribute, or 0). Kernels then get the chunk extended
+    by the halo, clipped at the volume edges, and only the interior
+    of their result is kept, so neighbourhood filters run without
+    seams. As halos must see unprocessed data, the results go to
+    a new array of the same kind as ``data``, which is returned.
+
+    If ``dtype`` differs from the type of ``data`` the results
+    likewise go to a new array of that type, so each chunk is
+    converted as it is processed. It defaults to the type of
+    ``data``, or for integer data, e.g. raw projections to
+    normalize, to the ``dtype`` attribute of the kernel, so
+    floating point data is still processed in place.
+    """
+    backend = _resolve_backend(func, data, axis, backend, pool)
+    if halo is None:
+        halo = getattr(func, 'halo', 0)
+    resident = isinstance(data, np.ndarray)
+    remote = getattr(pool, 'remote', False)
+
+    # Move data into shared memory once.
+    shared = shared and backend == 'processes' and resident and not remote
+    if shared and not is_shared(data):
+        data = _to_shared(data, axis, pool)
+
+    if dtype is None:
+        dtype = data.dtype
+        if np.issubdtype(data.dtype, np.integer):
+            dtype = getattr(func, 'dtype', data.dtype)
+    dtype = np.dtype(dtype)
+
+    out = None
+    if halo or dtype != data.dtype or (resident and _read_only(data)):
+        if shared:
+            out = _empty_shared_like(data, axis, pool, dtype)
+        elif resident:
+            out = np.empty_like(data, dtype=dtype)
+        else:
+            from tomopy.tools.outofcore import scratch_dataset
+            out = scratch_dataset(data.shape, dtype)
+
+    for progress in imap_jobs(data, func, args, axis, num_cores,
+                              chunk_size, shared, pool, schedule=schedule,
+                              backend=backend, report=report, out=out, halo=halo):
+        if callback is not None:
+            callback(*progress)
+    if out is not None:
+        return out
+    return data
+
+
+def imap_jobs(data, func, args, axis, num_cores=None, chunk_size=None,
+              shared=False, pool=None, max_pending=None, schedule='adaptive',
+              backend='processes', report=None, out=None, halo=0):
     """
+    Process ``data`` in place, yielding as chunks complete.
+
+    Results are written into ``data`` in the order they
+    arrive, so reassembly overlaps with computation. At most
+    ``max_pending`` chunks (twice the number of cores by
+    default) are in flight at any time, which bounds the
+    memory held by queued jobs and results.
+
+    If ``data`` is not an ndarray but an array-like on disk,
+    such as an HDF5 dataset, chunks are read ahead of their
+    submission and stored as they arrive, by background threads
+    (see ``tools.outofcore.Prefetcher`` and ``SlabWriter``), so
+    reading, computing and writing overlap. Unless given,
+    ``chunk_size`` is then limited so that a chunk holds about
+    64 MB, keeping the peak memory proportional to the chunk
+    size and the number of workers.
+
+    If given, results are written into ``out`` instead (see
+    ``distribute_jobs``), which must be shared if ``shared``.
+
+    Yields
+    ------
+    ind_start, ind_end, completed, total : scalar
+        Index range of the finished chunk along ``axis``,
+        the number of finished chunks and their total.
+    """
+    backend = _resolve_backend(func, data, axis, backend, pool)
+    if backend != 'processes':
+        shared, pool = False, None
+    resident = isinstance(data, np.ndarray)
+    remote = getattr(pool, 'remote', False)
+    if not resident or remote:
+        shared = False
+    target = data if out is None else out
+
     # Arrange number of processors.
     if num_cores is None:
         num_cores = mp.cpu_count()
+    if pool is not None:
+        num_cores = pool.num_cores
     dims = data.shape[axis]
-    
+
     # Maximum number of available processors for the task.
     if dims < num_cores:
         num_cores = dims
-    
-    # Arrange chunk size.
-    if chunk_size is None:
-        chunk_size = dims / num_cores
-    
-    # Determine pool size.
-    pool_size = dims / chunk_size + 1
-    
-    # Create multi-processing object.
-    multip = multiprocess(func, num_cores=num_cores)
-                          
-    # Populate jobs.
-    for m in range(pool_size):
-        ind_start = m*chunk_size
-        ind_end = (m+1)*chunk_size
-        if ind_start >= dims:
-            break
-        if ind_end > dims:
-            ind_end = dims
-        
-        # Add to queue.
-        if axis == 0:
-            multip.add_job((data[ind_start:ind_end, :, :], args, ind_start, ind_end))
-        elif axis == 1:
-            multip.add_job((data[:, ind_start:ind_end, :], args, ind_start, ind_end))
-        elif axis == 2:
-            multip.add_job((data[:, :, ind_start:ind_end], args, ind_start, ind_end))
-
-    # Collect results.
-    for each in multip.close_out():
-        if axis == 0:
-            data[each[0]:each[1], :, :] = each[2]
-        elif axis == 1:
-            data[:, each[0]:each[1], :] = each[2]
-        elif axis == 2:
-            data[:, :, each[0]:each[1]] = each[2]
-    return data
 
+    # Arrange chunks. Timings are kept per registered kernel, so
+    # that kernels of the same name in different modules differ.
+    name = kernel_name(func)
+    if chunk_size is None and schedule == 'static':
+        chunk_size = dims // num_cores
+    if chunk_size is None and not resident:
+        chunk_bytes = np.dtype(data.dtype).itemsize * int(np.prod(data.shape)) // dims
+        chunk_size = max(1, min(dims // num_cores,
+                                _OUT_OF_CORE_CHUNK_BYTES // max(chunk_bytes, 1)))
+    profile = None
+    if schedule == 'adaptive':
+        profile = cost_model.profile(name, data.shape, axis)
+    if profile is None:
+        chunks = schedule_chunks(dims, num_cores, chunk_size)
+    else:
+        chunks = schedule_chunks(dims, num_cores, chunk_size,
+                                 cost=profile, min_cost=_MIN_CHUNK_TIME)
+
+    if max_pending is None:
+        max_pending = 2 * num_cores
 
+    desc = None
+    if shared:
+        if not is_shared(data):
+            raise ValueError("shared processing needs an array from shared_array")
+        if out is not None and not is_shared(out):
+            raise ValueError("shared processing needs a shared output")
+        desc = _shared_desc(data, axis, out, halo)
 
+    # Arguments are pickled with every chunk.
+    args_bytes = 0
+    pickled = backend == 'processes'
+    if report is not None:
+        report.begin(func.__name__, backend, num_cores)
+        if pickled:
+            args_bytes = len(pickle.dumps(args, pickle.HIGHEST_PROTOCOL))
 
+    # Create multi-processing object or reuse the pool.
+    tic = time.time()
+    if backend == 'threads':
+        multip = multithread(func, num_cores=num_cores)
+    elif backend == 'serial':
+        multip = serial(func)
+    elif pool is None:
+        multip = multiprocess(func, num_cores=num_cores, shared=desc)
+    elif remote:
+        multip = pool.dispatch(func, axis=axis, halo=halo,
+                               dtype=np.dtype(target.dtype).str)
+    else:
+        multip = pool.dispatch(func, shared=desc, dims=dims)
 
+    total = len(chunks)
+    submitted = 0
+    completed = 0
+    timings = []
+    sent = {}
+    extended = {}
+    reader = writer = None
+    try:
+        # Chunks on disk are read and written by background threads.
+        if not resident:
+            from tomopy.tools.outofcore import Prefetcher, SlabWriter
+            if halo:
+                ranges = [_extend(ind_start, ind_end, halo, dims)
+                          for ind_start, ind_end in chunks]
+            else:
+                ranges = chunks
+            reader = Prefetcher(lambda ind_start, ind_end:
+                                _chunk(data, axis, ind_start, ind_end), ranges)
+            writer = SlabWriter(lambda ind_start, ind_end, res:
+                                _store(target, axis, ind_start, ind_end, res))
 
+        while completed < total:
+            # Keep the queue filled up to the limit.
+            while submitted < total and submitted - completed < max_pending:
+                ind_start, ind_end = chunks[submitted]
+                if shared:
+                    job = (ind_start, ind_end, args)
+                    bytes_sent = args_bytes
+                elif halo:
+                    # Kernels must not see each other's output.
+                    if reader is not None:
+                        ext_start, ext_end, chunk = reader.get()
+                    else:
+                        ext_start, ext_end = _extend(ind_start, ind_end, halo, dims)
+                        chunk = _chunk(data, axis, ext_start, ext_end)
+                    if not pickled:
+                        chunk = np.array(chunk)
+                    extended.setdefault((ext_start, ext_end), []).append((ind_start, ind_end))
+                    job = (chunk, args, ext_start, ext_end)
+                    bytes_sent = args_bytes + pickled * chunk.nbytes
+                else:
+                    if reader is not None:
+                        chunk = reader.get()[2]
+                    else:
+                        chunk = _chunk(data, axis, ind_start, ind_end)
+                    job = (chunk, args, ind_start, ind_end)
+                    bytes_sent = args_bytes + pickled * job[0].nbytes
+                sent[ind_start] = (time.time(), bytes_sent)
+                multip.add_job(job)
+                submitted += 1
 
+            # Write back each chunk as soon as it arrives.
+            ind_start, ind_end, res, stamp = multip.get_result()
+            received = time.time()
+            if res is not None and halo:
+                # Keep the interior of the extended chunk.
+                ext_start = ind_start
+                ind_start, ind_end = extended[(ind_start, ind_end)].pop(0)
+                res = _chunk(res, axis, ind_start - ext_start, ind_end - ext_start)
+            if res is not None and writer is not None:
+                writer.put(ind_start, ind_end, res)
+            elif res is not None and not (isinstance(target, np.ndarray) and
+                                          np.may_share_memory(res, target)):
+                _store(target, axis, ind_start, ind_end, res)
+            timings.append((ind_start, ind_end, stamp[1] - stamp[0]))
+            if report is not None:
+                submit_time, bytes_sent = sent[ind_start]
+                bytes_received = 0
+                if pickled and res is not None:
+                    bytes_received = res.nbytes
+                report.add(ind_start, ind_end, submit_time, stamp, received,
+                           time.time() - received, bytes_sent, bytes_received)
+            completed += 1
+            yield ind_start, ind_end, completed, total
+    except BaseException:
+        # Do not leave busy workers behind when the
+        # caller stops early or a job fails.
+        if reader is not None:
+            reader.close()
+        if writer is not None:
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+        if pool is None:
+            multip.terminate()
+        elif multip.is_alive():
+            # Pools shut down by a dead worker have closed queues.
+            try:
+                multip.close_out()
+            except (RuntimeError, ValueError):
+                pass
+        raise
 
+    multip.close_out()
+    if writer is not None:
+        writer.close()
+    if report is not None:
+        report.end(time.time() - tic)
 
+    # Timings of other nodes do not describe this one.
+    if not remote:
+        cost_model.record(name, data.shape, axis, timings)
+        cost_model.record_backend(name, data.shape, axis, backend, time.time() - tic)
 
 
+def _resolve_backend(func, data, axis, backend, pool=None):
+    # Cluster pools (see tools.distributed) run on their nodes.
+    if getattr(pool, 'remote', False):
+        return 'processes'
+    if backend == 'auto':
+        backend = cost_model.best_backend(kernel_name(func), data.shape, axis,
+                                          getattr(func, 'backend', 'processes'),
+                                          getattr(func, 'thread_safe', True))
+    if backend not in ('processes', 'threads', 'serial'):
+        raise ValueError("unknown backend: %s" % backend)
+    # Kernels with static state must not run concurrently in one process.
+    if backend == 'threads' and not getattr(func, 'thread_safe', True):
+        backend = 'processes'
+    return backend
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+import h5py
+import numpy as np
+import os
+import tempfile
+import threading
+import traceback
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+# Bytes held by one slab when a volume is streamed.
+_SLAB_BYTES = 64 * 2**20
+
+# Chunk cache of scratch files.
+_CACHE_BYTES = 256 * 2**20
+
+# Slabs read ahead, or waiting to be written, at most.
+_PREFETCH_DEPTH = 2
+
+
+def is_resident(data):
+    """
+    Check if ``data`` is held in memory, as opposed
+    to an HDF5 dataset streamed from disk.
+    """
+    return isinstance(data, np.ndarray)
+
+
+def scratch_dataset(shape, dtype='float32', dir_path=None):
+    """
+    Create a temporary HDF5 dataset for out-of-core volumes.
+
+    The dataset is chunked in tiles of 16 projections by 16
+    slices, so that slabs along both axes are read without
+    touching the rest of the volume. The file is removed when
+    the dataset is garbage collected.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the volume.
+
+    dtype : str, optional
+        Data type of the volume.
+
+    dir_path : str, optional
+        Directory of the scratch file. Defaults to the
+        default temporary directory.
+
+    Returns
+    -------
+    out : h5py.Dataset
+        Uninitialized dataset opened for reading and writing.
+    """
+    fd, file_name = tempfile.mkstemp(prefix='tomopy-', suffix='.h5', dir=dir_path)
+    os.close(fd)
+    f = h5py.File(file_name, 'w', rdcc_nbytes=_CACHE_BYTES)
+    chunks = [min(16, n) for n in shape]
+    chunks[2:] = shape[2:]
+    data = f.create_dataset('data', shape=tuple(shape), dtype=dtype,
+                            chunks=tuple(chunks))
+    data._scratch_file = _ScratchFile(f, file_name)
+    return data
+
+
+class _ScratchFile(object):
+    """
+    Owner of the file backing a scratch dataset.
+    """
+    def __init__(self, f, file_name):
+        self.f = f
+        self.file_name = file_name
+
+    def __del__(self):
+        try:
+            self.f.close()
+            os.remove(self.file_name)
+        except Exception:
+            pass
+
+
+def slab_length(shape, axis, itemsize, slab_bytes=None):
+    """
+    Number of indices along ``axis`` fitting in one slab.
+    """
+    if slab_bytes is None:
+        slab_bytes = _SLAB_BYTES
+    bytes_per_index = itemsize * int(np.prod(shape)) // max(shape[axis], 1)
+    return int(max(1, min(shape[axis], slab_bytes // max(bytes_per_index, 1))))
+
+
+def iter_slabs(shape, axis, itemsize, slab_bytes=None):
+    """
+    Iterate over ``(ind_start, ind_end)`` slab ranges along ``axis``.
+    """
+    length = slab_length(shape, axis, itemsize, slab_bytes)
+    for ind_start in range(0, shape[axis], length):
+        yield ind_start, min(ind_start+length, shape[axis])
+
+
+def _slab(ndim, axis, ind_start, ind_end):
+    slc = [slice(None)] * ndim
+    slc[axis] = slice(ind_start, ind_end)
+    return tuple(slc)
+
+
+class Prefetcher(object):
+    """
+    Read slabs ahead of their use in a background thread.
+
+    ``read(ind_start, ind_end)`` is called for the ranges of
+    ``slabs`` in order, and iterating yields ``(ind_start,
+    ind_end, slab)``, so the next slab is read while the current
+    one is processed. At most ``depth`` slabs are read ahead,
+    which bounds the memory held by the buffers.
+
+    Parameters
+    ----------
+    read : callable
+        Returns the slab of an index range.
+
+    slabs : list
+        ``(ind_start, ind_end)`` ranges to read.
+
+    depth : scalar, optional
+        Number of slabs read ahead.
+    """
+    def __init__(self, read, slabs, depth=None):
+        if depth is None:
+            depth = _PREFETCH_DEPTH
+        self.slabs = list(slabs)
+        self._read = read
+        self._queue = Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        for ind_start, ind_end in self.slabs:
+            if self._stop.is_set():
+                break
+            try:
+                item = (ind_start, ind_end, self._read(ind_start, ind_end))
+            except Exception:
+                self._queue.put((None, None, traceback.format_exc()))
+                break
+            self._queue.put(item)
+
+    def __iter__(self):
+        for m in range(len(self.slabs)):
+            yield self.get()
+
+    def get(self):
+        """
+        Wait for the next slab and return it
+        as ``(ind_start, ind_end, slab)``.
+        """
+        ind_start, ind_end, slab = self._queue.get()
+        if ind_start is None:
+            self.close()
+            raise RuntimeError("slab read failed:\n" + slab)
+        return ind_start, ind_end, slab
+
+    def close(self):
+        """
+        Stop reading ahead and drop the slabs read so far.
+        """
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except Empty:
+                pass
+
+
+class SlabWriter(object):
+    """
+    Write slabs in a background thread.
+
+    ``put`` hands a slab to ``write(ind_start, ind_end, slab)``
+    and returns at once, unless ``depth`` slabs are already
+    waiting, so the caller goes on computing while results are
+    flushed. ``close`` waits for the pending writes.
+
+    Parameters
+    ----------
+    write : callable
+        Stores the slab of an index range.
+
+    depth : scalar, optional
+        Number of slabs waiting to be written.
+    """
+    def __init__(self, write, depth=None):
+        if depth is None:
+            depth = _PREFETCH_DEPTH
+        self._write = write
+        self._queue = Queue(maxsize=max(1, depth))
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: # Poison Pill
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._write(*item)
+            except Exception:
+                self._error = traceback.format_exc()
+
+    def put(self, ind_start, ind_end, slab):
+        """
+        Queue a slab for writing.
+        """
+        if self._error is not None:
+            raise RuntimeError("slab write failed:\n" + self._error)
+        self._queue.put((ind_start, ind_end, slab))
+
+    def close(self):
+        """
+        Wait for the pending writes and stop the thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("slab write failed:\n" + self._error)
+
+
+def copy_slabs(src, dst, selection=None, axis=0):
+    """
+    Copy ``src`` into ``dst`` one slab at a time.
+
+    Parameters
+    ----------
+    src, dst : ndarray or h5py.Dataset
+        Source and destination volumes. The data
+        type is converted to that of ``dst``.
+
+    selection : tuple of slice, optional
+        Part of ``src`` to copy, given with explicit
+        start, stop and step. Its shape must match ``dst``.
+
+    axis : scalar, optional
+        Axis along which slabs are taken.
+
+    Returns
+    -------
+    mean : scalar
+        Mean of the copied values, taken as they pass.
+    """
+    if selection is None:
+        selection = tuple(slice(0, n, 1) for n in src.shape)
+    itemsize = max(np.dtype(src.dtype).itemsize, np.dtype(dst.dtype).itemsize)
+    sel = list(selection)
+    total = 0.
+    for ind_start, ind_end in iter_slabs(dst.shape, axis, itemsize):
+        slc = selection[axis]
+        sel[axis] = slice(slc.start + ind_start * slc.step,
+                          slc.start + ind_end * slc.step, slc.step)
+        slab = src[tuple(sel)]
+        dst[_slab(len(dst.shape), axis, ind_start, ind_end)] = slab
+        total += slab.sum(dtype=np.float64)
+    return total / max(int(np.prod(dst.shape)), 1)
+
+
+def stats(data, axis=0):
+    """
+    Minimum, maximum and mean of a volume, computed slab-wise.
+    """
+    vmin, vmax, total = np.inf, -np.inf, 0.
+    for ind_start, ind_end in iter_slabs(data.shape, axis, data.dtype.itemsize):
+        slab = data[_slab(len(data.shape), axis, ind_start, ind_end)]
+        vmin = min(vmin, slab.min())
+        vmax = max(vmax, slab.max())
+        total += slab.sum(dtype=np.float64)
+    return vmin, vmax, total / max(int(np.prod(data.shape)), 1)
+
+
+def rescale(data, offset, scale, axis=0):
+    """
+    Compute ``(data - offset) / scale`` in place, slab-wise.
+    """
+    for ind_start, ind_end in iter_slabs(data.shape, axis, data.dtype.itemsize):
+        slc = _slab(len(data.shape), axis, ind_start, ind_end)
+        slab = data[slc]
+        slab -= offset
+        slab /= scale
+        data[slc] = slab